@@ -39,7 +39,18 @@ import poplib
 import imaplib
 import re
 import select
+import errno
 import base64
+import array
+import bisect
+import collections
+import collections.abc
+import copy
+import itertools
+import queue
+import threading
+import zlib
+import tempfile
 
 try:
     # do we have a recent pykerberos?
@@ -129,14 +140,8 @@ def wrap_socket(sock, keyfile=None, certfile=None,
                          "operations")
     if keyfile and not certfile:
         raise ValueError("certfile must be specified")
-    context = ssl.SSLContext(ssl_version)
-    context.verify_mode = cert_reqs
-    if ca_certs:
-        context.load_verify_locations(ca_certs)
-    if certfile:
-        context.load_cert_chain(certfile, keyfile)
-    if ciphers:
-        context.set_ciphers(ciphers)
+    context = ssl_context(keyfile, certfile, cert_reqs, ssl_version, ca_certs,
+                          ciphers)
     return context.wrap_socket(
         sock=sock, server_side=server_side,
         do_handshake_on_connect=do_handshake_on_connect,
@@ -146,6 +151,214 @@ def wrap_socket(sock, keyfile=None, certfile=None,
 if ssl:
     ssl.wrap_socket = wrap_socket
 
+def ssl_context(keyfile=None, certfile=None, cert_reqs=ssl.CERT_NONE,
+                ssl_version=proto_best, ca_certs=None, ciphers=None,
+                context_class=ssl.SSLContext):
+    context = context_class(ssl_version)
+    context.verify_mode = cert_reqs
+    if ca_certs:
+        context.load_verify_locations(ca_certs)
+    if certfile:
+        context.load_cert_chain(certfile, keyfile)
+    if ciphers:
+        context.set_ciphers(ciphers)
+    return context
+
+class ResumingSSLContext(ssl.SSLContext):
+    '''SSL context that offers the TLS session last negotiated with it to
+    new connections, so that they resume it instead of doing a full
+    handshake.  See tls_context().
+    '''
+    session = None
+    connections = 0
+    resumed = 0
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        if self.session is not None and not kwargs.get('server_side'):
+            kwargs.setdefault('session', self.session)
+        return ssl.SSLContext.wrap_socket(self, sock, *args, **kwargs)
+
+    def keep_session(self, sslsock):
+        '''Count the connection and keep its session for the next one.
+        With TLS 1.3 the session comes after the handshake, so call this
+        once the server greeting was read.
+        '''
+        self.connections += 1
+        if sslsock.session_reused:
+            self.resumed += 1
+        if sslsock.session is not None:
+            self.session = sslsock.session
+
+# The SSL contexts by server, port and SSL settings.  A TLS session only
+# resumes with the context it was made with, and Python cannot store one,
+# so sessions are reused by the connections of this process only: other
+# accounts on the same server, extra sessions and reconnects.
+TLS_CONTEXTS = {}
+TLS_CONTEXTS_LOCK = threading.Lock()
+
+def tls_context(key, *args):
+    '''Return the ResumingSSLContext for key, made with ssl_context(*args)
+    the first time; without args, like the standard library's default.
+    '''
+    with TLS_CONTEXTS_LOCK:
+        if key not in TLS_CONTEXTS:
+            if args:
+                context = ssl_context(*args,
+                                      context_class=ResumingSSLContext)
+            else:
+                context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                context.load_default_certs()
+            TLS_CONTEXTS[key] = context
+        return TLS_CONTEXTS[key]
+
+# Seconds to wait for a connection attempt before racing the next address
+# of the server against it (RFC 8305)
+CONNECT_ATTEMPT_DELAY = 0.25
+
+# Name lookups by host, port and address family, shared by all accounts of a
+# run for DNS_CACHE_TTL seconds
+DNS_CACHE = {}
+DNS_CACHE_LOCK = threading.Lock()
+DNS_CACHE_TTL = 60
+
+def resolve(host, port, family=socket.AF_UNSPEC):
+    '''socket.getaddrinfo() for a TCP connection, from DNS_CACHE if recent.
+    '''
+    key = (host, port, family)
+    now = time.monotonic()
+    with DNS_CACHE_LOCK:
+        if key in DNS_CACHE and DNS_CACHE[key][0] > now:
+            return DNS_CACHE[key][1]
+    addrinfos = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+    with DNS_CACHE_LOCK:
+        DNS_CACHE[key] = (now + DNS_CACHE_TTL, addrinfos)
+    return addrinfos
+
+def interleave_addrinfos(addrinfos, prefer=socket.AF_UNSPEC):
+    '''Order addrinfos alternating between address families, starting with
+    prefer, or else the family listed first (RFC 8305 section 4).
+    '''
+    families = {}
+    for addrinfo in addrinfos:
+        families.setdefault(addrinfo[0], []).append(addrinfo)
+    if prefer in families:
+        families = dict([(prefer, families.pop(prefer))]
+                        + list(families.items()))
+    return [addrinfo
+            for group in itertools.zip_longest(*families.values())
+            for addrinfo in group if addrinfo is not None]
+
+def connect_racing(host, port, timeout=None, prefer=socket.AF_UNSPEC,
+                   timings=None):
+    '''Like socket.create_connection(), but instead of trying the addresses
+    of host one after the other, start connecting to the next one each
+    CONNECT_ATTEMPT_DELAY seconds, or as soon as an attempt fails, and use
+    the first connection established (RFC 8305).  That way an unreachable
+    IPv6 address costs a fraction of a second instead of the whole timeout.
+
+    The time taken by the name lookup and by connecting goes into timings
+    as 'dns' and 'tcp'.
+    '''
+    if timeout is None or timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        timeout = socket.getdefaulttimeout()
+    start = time.monotonic()
+    addrinfos = interleave_addrinfos(resolve(host, port), prefer)
+    resolved = time.monotonic()
+    if timings is not None:
+        timings['dns'] = resolved - start
+    deadline = None if timeout is None else resolved + timeout
+    error = OSError('getaddrinfo returns an empty list')
+    pending = {}
+    sock = None
+    next_attempt = resolved
+    try:
+        while sock is None and (addrinfos or pending):
+            now = time.monotonic()
+            if addrinfos and now >= next_attempt:
+                (af, socktype, proto, _, sa) = addrinfos.pop(0)
+                attempt = socket.socket(af, socktype, proto)
+                attempt.setblocking(False)
+                err = attempt.connect_ex(sa)
+                if err == 0:
+                    sock = attempt
+                elif err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    pending[attempt] = sa
+                    next_attempt = now + CONNECT_ATTEMPT_DELAY
+                else:
+                    error = OSError(err, os.strerror(err))
+                    attempt.close()
+                continue
+            if deadline is not None and now >= deadline:
+                raise socket.timeout('timed out')
+            wake = deadline
+            if addrinfos and (wake is None or next_attempt < wake):
+                wake = next_attempt
+            (_, done, _) = select.select(
+                [], list(pending), [], None if wake is None else wake - now)
+            for attempt in done:
+                del pending[attempt]
+                err = attempt.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    error = OSError(err, os.strerror(err))
+                    attempt.close()
+                    next_attempt = now
+                elif sock is None:
+                    sock = attempt
+                else:
+                    attempt.close()
+    finally:
+        for attempt in pending:
+            attempt.close()
+    if sock is None:
+        raise error
+    sock.settimeout(timeout)
+    if timings is not None:
+        timings['tcp'] = time.monotonic() - resolved
+    return sock
+
+class RacingConnectMixIn(object):
+    '''Mix-in for the imaplib and poplib classes to connect with
+    connect_racing(), trying addresses of family prefer first, and keep the
+    time taken by each phase of connecting in self.timings.
+    '''
+    prefer = socket.AF_UNSPEC
+
+    def __init__(self, *args, **kwargs):
+        self.prefer = kwargs.pop('prefer', socket.AF_UNSPEC)
+        super().__init__(*args, **kwargs)
+
+    def _create_socket(self, timeout):
+        self.started = time.monotonic()
+        self.timings = {}
+        return connect_racing(self.host, self.port, timeout, self.prefer,
+                              self.timings)
+
+    def _handshake(self, sock, context, server_hostname):
+        start = time.monotonic()
+        sock = context.wrap_socket(sock, server_hostname=server_hostname)
+        self.timings['tls'] = time.monotonic() - start
+        return sock
+
+class IMAP4_RACING(RacingConnectMixIn, imaplib.IMAP4):
+    pass
+
+class IMAP4_SSL_RACING(RacingConnectMixIn, imaplib.IMAP4_SSL):
+    def _create_socket(self, timeout):
+        return self._handshake(
+            RacingConnectMixIn._create_socket(self, timeout),
+            self.ssl_context, self.host)
+
+class POP3_RACING(RacingConnectMixIn, poplib.POP3):
+    pass
+
+class POP3_SSL_RACING(RacingConnectMixIn, poplib.POP3_SSL):
+    def _create_socket(self, timeout):
+        return self._handshake(
+            RacingConnectMixIn._create_socket(self, timeout),
+            self.context, self.host)
+
 ##############################################
 # to avoid deprecation warnings
 # match_hostname from Python 3.10 ssl.py
@@ -384,6 +597,253 @@ def mailbox_names(resplist):
     return mailboxes
 IMAP_ATOM_SPECIAL=re.compile(r'[\x00-\x1F\(\)\{ %\*"\\\]]')
 
+# For finding the UID in the (partial) lines of a FETCH response
+IMAP_FETCH_UID = re.compile(rb'\bUID (\d+)')
+
+# For the result of UID SEARCH RETURN (ALL) (RFC 4731)
+IMAP_ESEARCH_ALL = re.compile(rb'\bALL\s+([0-9:,]+)')
+
+# For the UIDs in a VANISHED response (RFC 7162)
+IMAP_VANISHED = re.compile(rb'^(?:\(EARLIER\)\s+)?([0-9:,]+)')
+
+# For capabilities sent along with the tagged OK of LOGIN or AUTHENTICATE
+IMAP_CAPABILITY_CODE = re.compile(rb'\[CAPABILITY ([^\]]*)\]')
+
+# Gmail's message metadata (X-GM-EXT-1), fetched along with the message
+IMAP_GMAIL_ITEMS = 'X-GM-LABELS X-GM-THRID X-GM-MSGID'
+
+# One token of IMAP response data: a parenthesis, a quoted string, a literal
+# ({n}; imaplib hands over the literal itself separately), or an atom, which
+# includes a section with spaces in it, like BODY[HEADER.FIELDS (TO)]
+IMAP_TOKEN = re.compile(
+    rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\+?\}'
+    rb'|((?:[^\s()"\[]|\[[^\]]*\]|\[)+))'
+)
+IMAP_UNQUOTE = re.compile(rb'\\(.)')
+# A FETCH response without lists or strings, like the UID RFC822.SIZE listing
+IMAP_FETCH_FLAT = re.compile(rb'\d+ \(([^()"{]*)\)\s*')
+# Characters that make a string need quoting (a flag may start with \)
+IMAP_ATOM_SPECIALS = re.compile(rb'[\s()"{%*\]]|.\\')
+
+# STATUS items used to detect unchanged mailboxes, and their keys in the
+# mailbox state file
+IMAP_STATUS_KEYS = {
+    'MESSAGES': 'messages',
+    'UIDNEXT': 'uidnext',
+    'UIDVALIDITY': 'uidvalidity',
+    'HIGHESTMODSEQ': 'modseq',
+}
+
+# What select_mailbox() leaves for the messages of a mailbox; see
+# IMAPSessionPool
+IMAP_MAILBOX_STATE = (
+    'mailbox_selected', 'mailbox', 'uidvalidity', 'msgnum_by_msgid',
+    'msgid_by_msgnum', 'sorted_msgnum_msgid', 'msgsizes', 'oldmail',
+    '_mboxuids', '_mboxuidorder', '_uidmax', '_uidmax_changed',
+    '_highestmodseq', '_selectstatus', '_qresyncing', '_exists', 'gotmsglist',
+    '_deletequeue', 'deleted',
+)
+
+# Octets read at a time when spooling a literal to disk
+IMAP_SPOOL_CHUNK = 65536
+
+# Upper bounds for one FETCH over a sequence set while listing a mailbox:
+# number of messages, and length of the sequence set on the command line.
+IMAP_LIST_CHUNK = 5000
+IMAP_LIST_CHUNK_CHARS = 1000
+
+def imap_seqranges(nums):
+    '''Sort message numbers or UIDs into a list of contiguous [lo, hi] ranges.
+    '''
+    ranges = []
+    for n in sorted(set(int(n) for n in nums)):
+        if ranges and n == ranges[-1][1] + 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return ranges
+
+def imap_parse_seqset(seqset):
+    '''Parse an IMAP sequence set without "*", i.e. "1:3,5" -> [[1, 3], [5, 5]].
+    '''
+    if isinstance(seqset, bytes):
+        seqset = seqset.decode()
+    ranges = []
+    for part in seqset.strip().split(','):
+        if not part:
+            continue
+        (lo, _, hi) = part.partition(':')
+        (lo, hi) = (int(lo), int(hi or lo))
+        ranges.append([min(lo, hi), max(lo, hi)])
+    return ranges
+
+def imap_inseqranges(ranges, n):
+    '''Test whether n is in one of the sorted, disjoint [lo, hi] ranges.
+    '''
+    i = bisect.bisect_right(ranges, [n, float('inf')]) - 1
+    return i >= 0 and ranges[i][0] <= n <= ranges[i][1]
+
+def imap_parse_status(data):
+    '''Parse the data of a STATUS response into a dict, i.e.
+    [b'INBOX (MESSAGES 3 UIDNEXT 5)'] -> {'messages': '3', 'uidnext': '5'}.
+    '''
+    status = {}
+    for line in data:
+        if not isinstance(line, bytes) or not line.rstrip().endswith(b')'):
+            # mailbox name sent as literal
+            continue
+        parts = imap_tokenize(line)[-1]
+        for (item, value) in zip(parts[::2], parts[1::2]):
+            status[item.decode().lower()] = value.decode()
+    return status
+
+def imap_status_mailbox(line):
+    '''Return the (decoded) mailbox name of a STATUS response line.'''
+    name = imap_tokenize(line)[0]
+    if not isinstance(name, bytes):
+        # sent as literal
+        name = b''
+    return codecs.decode(name, 'imap4-utf-7')
+
+def imap_tokenize(data):
+    '''Split IMAP response data into tokens in one pass, with lists as nested
+    lists, i.e. b'1 (UID 5 FLAGS (\\Seen))' ->
+    [b'1', [b'UID', b'5', b'FLAGS', [b'\\Seen']]].  Quoted strings come
+    unquoted, literals as None.  Lists still open at the end are closed.
+    '''
+    data = data.rstrip()
+    tokens = []
+    stack = []
+    pos = 0
+    for m in IMAP_TOKEN.finditer(data):
+        if m.start() != pos:
+            raise ValueError('unparsable IMAP data at %r' % data[pos:pos + 20])
+        pos = m.end()
+        (opening, closing, quoted, literal, atom) = m.groups()
+        if atom is not None:
+            tokens.append(atom)
+        elif opening:
+            stack.append(tokens)
+            tokens = []
+            stack[-1].append(tokens)
+        elif closing:
+            if stack:
+                tokens = stack.pop()
+        elif literal is not None:
+            tokens.append(None)
+        else:
+            if b'\\' in quoted:
+                quoted = IMAP_UNQUOTE.sub(rb'\1', quoted)
+            tokens.append(quoted)
+    if pos != len(data):
+        raise ValueError('unparsable IMAP data at %r' % data[pos:pos + 20])
+    return stack[0] if stack else tokens
+
+def imap_parse_fetch(data):
+    '''Parse the data of a FETCH response into a dict, i.e.
+    b'1 (UID 5 FLAGS (\\Seen))' -> {'uid': '5', 'flags': [b'\\Seen']}.
+    Atoms and strings come decoded, lists as from imap_tokenize().
+    '''
+    m = IMAP_FETCH_FLAT.fullmatch(data)
+    if m:
+        parts = m.group(1).decode().split()
+    else:
+        parts = next((t for t in imap_tokenize(data) if isinstance(t, list)),
+                     None)
+        if parts is None:
+            raise ValueError('no FETCH items')
+    if len(parts) % 2:
+        # Leftover part -- not name, value pair.
+        raise ValueError('odd number of FETCH items')
+    r = {}
+    for i in range(0, len(parts), 2):
+        (name, value) = (parts[i], parts[i + 1])
+        if isinstance(name, bytes):
+            name = name.decode()
+        if isinstance(value, bytes):
+            value = value.decode()
+        r[name.lower()] = value
+    return r
+
+def imap_quote(token):
+    '''Quote an IMAP string token if it is not a valid atom.'''
+    if token and not IMAP_ATOM_SPECIALS.search(token):
+        return token
+    return b'"%s"' % token.replace(b'\\', b'\\\\').replace(b'"', b'\\"')
+
+def imap_parse_gmailmetadata(data):
+    '''Return the X-GMAIL-* headers for the Gmail metadata items in the
+    FETCH response data, or None if the server sent none of them.
+    '''
+    if b'X-GM-' not in data:
+        return None
+    try:
+        items = imap_parse_fetch(data)
+    except (ValueError, AttributeError):
+        return None
+    metadata = {}
+    labels = items.get('x-gm-labels')
+    if labels:
+        metadata['X-GMAIL-LABELS'] = b' '.join(
+            imap_quote(label) for label in labels if isinstance(label, bytes))
+    for item in ('THRID', 'MSGID'):
+        value = items.get('x-gm-%s' % item.lower())
+        if isinstance(value, str) and value:
+            metadata['X-GMAIL-%s' % item] = value.encode()
+    return metadata
+
+def imap_spool_literals(conn, threshold):
+    '''Have imaplib read literals of more than threshold octets, i.e. large
+    message bodies, into a temporary file instead of a bytes object.  It
+    uses read() for literals only.
+    '''
+    read = conn.read
+    def spooled(size):
+        if size <= threshold:
+            return read(size)
+        spool = tempfile.TemporaryFile()
+        while size > 0:
+            chunk = read(min(size, IMAP_SPOOL_CHUNK))
+            if not chunk:
+                raise imaplib.IMAP4.abort('connection closed in literal')
+            spool.write(chunk)
+            size -= len(chunk)
+        spool.seek(0)
+        return spool
+    conn.read = spooled
+
+def _seqrange(lo, hi):
+    return lo == hi and '%d' % lo or '%d:%d' % (lo, hi)
+
+def imap_seqset(nums):
+    '''Compress message numbers or UIDs into an IMAP sequence set, i.e.
+    [1, 2, 3, 5, 7, 8] -> "1:3,5,7:8".
+    '''
+    return ','.join(_seqrange(lo, hi) for (lo, hi) in imap_seqranges(nums))
+
+def imap_seqset_chunks(ranges, maxcount=IMAP_LIST_CHUNK,
+                       maxchars=IMAP_LIST_CHUNK_CHARS):
+    '''Split [lo, hi] ranges into sequence sets each covering at most maxcount
+    messages and at most (about) maxchars characters long.
+    '''
+    parts = []
+    count = 0
+    chars = 0
+    for (lo, hi) in ranges:
+        while lo <= hi:
+            if parts and (count >= maxcount or chars >= maxchars):
+                yield ','.join(parts)
+                parts = []
+                count = chars = 0
+            end = min(hi, lo + (maxcount - count) - 1)
+            part = _seqrange(lo, end)
+            parts.append(part)
+            count += end - lo + 1
+            chars += len(part) + 1
+            lo = end + 1
+    if parts:
+        yield ','.join(parts)
+
 # Constants used in socket module
 NO_OBJ = object()
 EAI_NONAME = getattr(socket, 'EAI_NONAME', NO_OBJ)
@@ -402,11 +862,222 @@ POP3_SSL_PORT = 995
 # "line" exceeds 2048 bytes is absolutely stupid.
 poplib._MAXLINE = 1 << 20   # 1MB; decrease this if you're running on a VIC-20
 
+# Octets of a multi-line POP3 response written to disk at a time when
+# spooling, see pop3_read_multiline()
+POP3_SPOOL_CHUNK = 65536
+
+# Most messages appended since the last session that are listed one by one
+# with pop3_checkpoint, rather than listing the whole maildrop
+POP3_CHECKPOINT_PROBES = 50
+
+def pop3_unstuff(data):
+    '''Turn whole lines of a multi-line POP3 response into message data:
+    CRLF to LF, and undo the dot-stuffing of lines starting with a dot.
+    '''
+    data = data.replace(b'\r\n', b'\n')
+    if data.startswith(b'..'):
+        data = data[1:]
+    return data.replace(b'\n..', b'\n.')
+
+def pop3_read_multiline(conn, threshold=0):
+    '''Read the rest of a multi-line POP3 response, after the status line,
+    up to the terminating ".".  Unlike poplib, which makes a bytes object
+    of every line, this reads what the connection has buffered at a time,
+    finds the end with bytes.find() and unstuffs with bytes.replace(), and
+    stops right after the terminator, so that pipelined replies are left
+    alone.
+
+    Returns the message data and the number of octets received for it.
+    With threshold, data of more than threshold octets is written to a
+    temporary file instead, which is returned (rewound).
+    '''
+    buf = bytearray()
+    spool = None
+    octets = 0
+    while True:
+        chunk = conn.file.peek(POP3_SPOOL_CHUNK)
+        if not chunk:
+            raise poplib.error_proto('-ERR EOF')
+        # A terminator may start in what was read before.  buf always starts
+        # a line, at the start of the data or after a cut at a newline that
+        # went to the spool, so it is taken as preceded by a newline.
+        before = bytes((b'\n' + buf)[-3:])
+        window = before + chunk
+        ends = [(window.find(term), len(term))
+                for term in (b'\n.\r\n', b'\n.\n')]
+        ends = [(i, length) for (i, length) in ends if i >= 0]
+        if ends:
+            (i, length) = min(ends)
+            end = i + 1 - len(before)
+            if end < 0:
+                del buf[end:]
+            else:
+                buf += chunk[:end]
+            octets += end
+            conn.file.read(i + length - len(before))
+            break
+        buf += conn.file.read(len(chunk))
+        octets += len(chunk)
+        if threshold > 0 and (spool or octets > threshold) and (
+                len(buf) >= POP3_SPOOL_CHUNK):
+            if spool is None:
+                spool = tempfile.TemporaryFile()
+            cut = buf.rfind(b'\n') + 1
+            spool.write(pop3_unstuff(buf[:cut]))
+            del buf[:cut]
+    if spool is None:
+        return pop3_unstuff(bytes(buf)), octets
+    spool.write(pop3_unstuff(buf))
+    spool.seek(0)
+    return spool, octets
+
+def pop3_iter_multiline(conn):
+    '''Yield the lines of the rest of a multi-line POP3 response, after the
+    status line, unstuffed and without line endings.  Unlike poplib, which
+    returns a list of all of them, this keeps no line once it is consumed.
+    '''
+    (line, _) = conn._getline()
+    while line != b'.':
+        if line.startswith(b'..'):
+            line = line[1:]
+        yield line
+        (line, _) = conn._getline()
+
+class POP3MessageTable(object):
+    '''Compact table of the messages of a POP3 maildrop, from its UIDL and
+    LIST responses.  Each message ID is kept once, in a list; message
+    numbers and sizes are kept in arrays by the index of the message ID.
+    Message numbers are looked up by bisection, so the only per-message
+    dictionary is the one from message ID to index.
+
+    msgnum_by_msgid, msgid_by_msgnum, msgsizes and sorted_msgnum_msgid are
+    read-only views of it, in the form RetrieverSkeleton expects.
+    '''
+    def __init__(self):
+        self.msgids = []
+        self.index = {}
+        self.msgnums = array.array('q')
+        self.sizes = array.array('q')
+        self.ordered = True
+        self.msgnum_by_msgid = _MsgnumByMsgid(self)
+        self.msgid_by_msgnum = _MsgidByMsgnum(self)
+        self.msgsizes = _MsgSizes(self)
+        self.sorted_msgnum_msgid = _SortedMsgnumMsgid(self)
+
+    def __len__(self):
+        return len(self.msgids)
+
+    def add(self, msgnum, msgid, size=-1):
+        '''Add a message; False if msgid is already in the table.  A size of
+        -1 means the message was not in the LIST response (yet).
+        '''
+        if msgid in self.index:
+            return False
+        if self.msgnums and msgnum < self.msgnums[-1]:
+            self.ordered = False
+        self.index[msgid] = len(self.msgids)
+        self.msgids.append(msgid)
+        self.msgnums.append(msgnum)
+        self.sizes.append(size)
+        return True
+
+    def sort(self):
+        '''Put the messages in order of message number, if the server did
+        not list them that way.'''
+        if self.ordered:
+            return
+        order = sorted(range(len(self.msgids)), key=self.msgnums.__getitem__)
+        self.msgids = [self.msgids[i] for i in order]
+        self.msgnums = array.array('q', [self.msgnums[i] for i in order])
+        self.sizes = array.array('q', [self.sizes[i] for i in order])
+        self.index = dict((msgid, i) for (i, msgid) in enumerate(self.msgids))
+        self.ordered = True
+
+    def find(self, msgnum):
+        '''Return the index of message number msgnum, or None.'''
+        # Message numbers are usually 1..n without gaps.
+        i = msgnum - 1
+        if 0 <= i < len(self.msgnums) and self.msgnums[i] == msgnum:
+            return i
+        i = bisect.bisect_left(self.msgnums, msgnum)
+        if i < len(self.msgnums) and self.msgnums[i] == msgnum:
+            return i
+        return None
+
+    def setsize(self, msgnum, size):
+        '''Record the size of message number msgnum, if it is known.'''
+        i = self.find(msgnum)
+        if i is not None:
+            self.sizes[i] = size
+
+class _MessageTableView(collections.abc.Mapping):
+    def __init__(self, table):
+        self.table = table
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class _MsgnumByMsgid(_MessageTableView):
+    def __getitem__(self, msgid):
+        return self.table.msgnums[self.table.index[msgid]]
+
+    def __iter__(self):
+        return iter(self.table.msgids)
+
+    def __len__(self):
+        return len(self.table.msgids)
+
+class _MsgidByMsgnum(_MessageTableView):
+    def __getitem__(self, msgnum):
+        i = self.table.find(msgnum)
+        if i is None:
+            raise KeyError(msgnum)
+        return self.table.msgids[i]
+
+    def __iter__(self):
+        return iter(self.table.msgnums)
+
+    def __len__(self):
+        return len(self.table.msgnums)
+
+class _MsgSizes(_MessageTableView):
+    '''Sizes of the messages that were in the LIST response.'''
+    def __getitem__(self, msgid):
+        size = self.table.sizes[self.table.index[msgid]]
+        if size < 0:
+            raise KeyError(msgid)
+        return size
+
+    def __iter__(self):
+        return (msgid for (msgid, size)
+                in zip(self.table.msgids, self.table.sizes) if size >= 0)
+
+    def __len__(self):
+        return sum(1 for size in self.table.sizes if size >= 0)
+
+class _SortedMsgnumMsgid(collections.abc.Sequence):
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, i):
+        return (self.table.msgnums[i], self.table.msgids[i])
+
+    def __len__(self):
+        return len(self.table.msgids)
+
 #######################################
 class CertMixIn(object):
     def ssl_cipher_hash(self):
         sslobj = self.conn.sock
+        self._connected()
         self.setup_received(sslobj)
+        context = sslobj.context
+        if isinstance(context, ResumingSSLContext):
+            context.keep_session(sslobj)
+            self.log.debug('TLS session %s (%d of %d connections resumed)'
+                           % (sslobj.session_reused and 'resumed' or 'new',
+                              context.resumed, context.connections)
+                           + os.linesep)
         peercert = sslobj.getpeercert(True)
         ssl_cipher = sslobj.cipher()
         if ssl_cipher:
@@ -449,7 +1120,9 @@ class POP3initMixIn(object):
     def _connect(self):
         self.log.trace()
         try:
-            self.conn = poplib.POP3(self.conf['server'], self.conf['port'])
+            self.conn = POP3_RACING(self.conf['server'], self.conf['port'],
+                                    prefer=check_address_preference(self.conf))
+            self._connected()
             self.setup_received(self.conn.sock)
         except poplib.error_proto as o:
             raise getmailOperationError('POP error (%s)' % o)
@@ -467,13 +1140,14 @@ class POP3initMixIn(object):
 
 
 #######################################
-class POP3_SSL_EXTENDED(poplib.POP3_SSL):
+class POP3_SSL_EXTENDED(RacingConnectMixIn, poplib.POP3_SSL):
     # Extended SSL support for POP3 (certificate checking,
     # fingerprint matching, cipher selection, etc.)
 
     def __init__(self, host, port=POP3_SSL_PORT, keyfile=None,
                  certfile=None, ssl_version=None, ca_certs=None,
-                 ssl_ciphers=None):
+                 ssl_ciphers=None, prefer=socket.AF_UNSPEC):
+        self.prefer = prefer
         self.host = host
         self.port = port
         self.keyfile = keyfile
@@ -483,26 +1157,7 @@ class POP3_SSL_EXTENDED(poplib.POP3_SSL):
         self.ssl_ciphers = ssl_ciphers
 
         self.buffer = ''
-        msg = "getaddrinfo returns an empty list"
-        self.sock = None
-        for res in socket.getaddrinfo(self.host, self.port, 0,
-                                      socket.SOCK_STREAM):
-            (af, socktype, proto, _, sa) = res
-            try:
-                self.sock = socket.socket(af, socktype, proto)
-                self.sock.connect(sa)
-            except socket.error as e:
-                msg = e
-                if self.sock:
-                    self.sock.close()
-                self.sock = None
-                continue
-            break
-        if not self.sock:
-            if isinstance(msg, Exception):
-              raise msg
-            else:
-              raise socket.error(msg)
+        self.sock = RacingConnectMixIn._create_socket(self, None)
         extra_args = { 'server_hostname': host }
         if self.ssl_version:
             extra_args['ssl_version'] = self.ssl_version
@@ -513,8 +1168,14 @@ class POP3_SSL_EXTENDED(poplib.POP3_SSL):
             extra_args['ciphers'] = self.ssl_ciphers
 
         if ssl:
-            self.sock = ssl.wrap_socket(self.sock, self.keyfile,
-                                        self.certfile, **extra_args)
+            context = tls_context(
+                (host, port, self.keyfile, self.certfile, self.ssl_version,
+                 self.ca_certs, self.ssl_ciphers),
+                self.keyfile, self.certfile,
+                extra_args.get('cert_reqs', ssl.CERT_NONE),
+                self.ssl_version or proto_best, self.ca_certs, self.ssl_ciphers)
+            self.sock = self._handshake(self.sock, context,
+                                        has_sni and host or None)
 
         try:
             self.file = self.sock.makefile('rb')
@@ -535,6 +1196,7 @@ class POP3SSLinitMixIn(CertMixIn):
         ca_certs = check_ca_certs(self.conf)
         ssl_version = check_ssl_version(self.conf)
         ssl_ciphers = check_ssl_ciphers(self.conf)
+        prefer = check_address_preference(self.conf)
         using_extended_certs_interface = False
         try:
             if ca_certs or ssl_version or ssl_ciphers:
@@ -559,7 +1221,7 @@ class POP3SSLinitMixIn(CertMixIn):
                 )
                 self.conn = POP3_SSL_EXTENDED(
                     self.conf['server'], self.conf['port'], keyfile, certfile,
-                    ssl_version, ca_certs, ssl_ciphers
+                    ssl_version, ca_certs, ssl_ciphers, prefer=prefer
                 )
             elif keyfile:
                 self.log.trace(
@@ -569,15 +1231,19 @@ class POP3SSLinitMixIn(CertMixIn):
                        certfile)
                     + os.linesep
                 )
-                self.conn = poplib.POP3_SSL(
-                    self.conf['server'], self.conf['port'], keyfile, certfile
+                self.conn = POP3_SSL_RACING(
+                    self.conf['server'], self.conf['port'], keyfile, certfile,
+                    prefer=prefer
                 )
             else:
                 self.log.trace('establishing POP3 SSL connection to %s:%d'
                                % (self.conf['server'], self.conf['port'])
                                + os.linesep)
-                self.conn = poplib.POP3_SSL(self.conf['server'],
-                                            self.conf['port'])
+                self.conn = POP3_SSL_RACING(
+                    self.conf['server'], self.conf['port'],
+                    context=tls_context((self.conf['server'],
+                                         self.conf['port'])),
+                    prefer=prefer)
             ssl_cipher, actual_hash = self.ssl_cipher_hash()
         except poplib.error_proto as o:
             raise getmailOperationError('POP error (%s)' % o)
@@ -602,6 +1268,89 @@ class POP3SSLinitMixIn(CertMixIn):
             self.log.trace(fingerprint_message)
 
 
+#######################################
+class IMAPDeflate(object):
+    '''COMPRESS=DEFLATE (RFC 4978) for an imaplib connection.  Takes the place
+    of the connection's file for reading and of its send() for writing, and
+    counts octets and CPU time for the summary.
+    '''
+    def __init__(self, conn):
+        self.sock = conn.sock
+        self.inflater = zlib.decompressobj(-15)
+        self.deflater = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                         zlib.DEFLATED, -15)
+        self.buf = bytearray()
+        self.wirein = 0
+        self.datain = 0
+        self.wireout = 0
+        self.dataout = 0
+        self.cpu = 0.0
+        conn.file.close()
+        conn.file = self
+        conn.send = self.send
+
+    def _fill(self):
+        wire = self.sock.recv(65536)
+        if not wire:
+            return False
+        start = time.process_time()
+        data = self.inflater.decompress(wire)
+        self.cpu += time.process_time() - start
+        self.wirein += len(wire)
+        self.datain += len(data)
+        self.buf += data
+        return True
+
+    def read(self, size):
+        while len(self.buf) < size:
+            if not self._fill():
+                break
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        return data
+
+    def readline(self, limit=-1):
+        start = 0
+        while True:
+            end = self.buf.find(b'\n', start)
+            if end >= 0:
+                end += 1
+                break
+            if 0 < limit <= len(self.buf):
+                end = limit
+                break
+            start = len(self.buf)
+            if not self._fill():
+                end = len(self.buf)
+                break
+        if 0 < limit < end:
+            end = limit
+        data = bytes(self.buf[:end])
+        del self.buf[:end]
+        return data
+
+    def buffered(self):
+        '''Whether data was read from the socket that is not consumed yet.'''
+        return bool(self.buf) or bool(getattr(self.sock, 'pending', int)())
+
+    def send(self, data):
+        start = time.process_time()
+        wire = (self.deflater.compress(data)
+                + self.deflater.flush(zlib.Z_SYNC_FLUSH))
+        self.cpu += time.process_time() - start
+        self.dataout += len(data)
+        self.wireout += len(wire)
+        self.sock.sendall(wire)
+
+    def close(self):
+        pass
+
+    def summary(self):
+        return ('COMPRESS: %d octets received as %d, %d sent as %d, '
+                '%.3fs CPU' % (self.datain, self.wirein, self.dataout,
+                               self.wireout, self.cpu))
+
+
 #######################################
 class IMAPinitMixIn(object):
     '''Mix-In class to do IMAP non-SSL initialization.
@@ -610,7 +1359,9 @@ class IMAPinitMixIn(object):
     def _connect(self):
         self.log.trace()
         try:
-            self.conn = imaplib.IMAP4(self.conf['server'], self.conf['port'])
+            self.conn = IMAP4_RACING(self.conf['server'], self.conf['port'],
+                                     prefer=check_address_preference(self.conf))
+            self._connected()
             self.setup_received(self.conn.sock)
         except imaplib.IMAP4.error as o:
             raise getmailOperationError('IMAP error (%s)' % o)
@@ -625,12 +1376,13 @@ class IMAPinitMixIn(object):
 
 
 #######################################
-class IMAP4_SSL_EXTENDED(imaplib.IMAP4_SSL):
+class IMAP4_SSL_EXTENDED(RacingConnectMixIn, imaplib.IMAP4_SSL):
     # Similar to above, but with extended support for SSL certificate checking,
     # fingerprints, etc.
     def __init__(self, host='', port=imaplib.IMAP4_SSL_PORT, keyfile=None,
                  certfile=None, ssl_version=None, ca_certs=None,
-                 ssl_ciphers=None):
+                 ssl_ciphers=None, prefer=socket.AF_UNSPEC):
+       self.prefer = prefer
        self.ssl_version = ssl_version
        self.ca_certs = ca_certs
        self.ssl_ciphers = ssl_ciphers
@@ -645,7 +1397,7 @@ class IMAP4_SSL_EXTENDED(imaplib.IMAP4_SSL):
     def open(self, host='', port=imaplib.IMAP4_SSL_PORT, timeout=None):
        self.host = host
        self.port = port
-       self.sock = socket.create_connection((host, port))
+       self.sock = RacingConnectMixIn._create_socket(self, None)
 
        # Note timeout is available in python 3.9 in native imaplib's/ssl's open,
        # but wrap_socket does not support it.  Keep it for the future.
@@ -661,8 +1413,14 @@ class IMAP4_SSL_EXTENDED(imaplib.IMAP4_SSL):
            extra_args['ciphers'] = self.ssl_ciphers
 
        if ssl:
-           self.sock = ssl.wrap_socket(self.sock, self.keyfile, self.certfile,
-                                     **extra_args)
+           context = tls_context(
+               (host, port, self.keyfile, self.certfile, self.ssl_version,
+                self.ca_certs, self.ssl_ciphers),
+               self.keyfile, self.certfile,
+               extra_args.get('cert_reqs', ssl.CERT_NONE),
+               self.ssl_version or proto_best, self.ca_certs, self.ssl_ciphers)
+           self.sock = self._handshake(self.sock, context,
+                                       has_sni and host or None)
 
        try:
            self.file = self.sock.makefile('rb')
@@ -681,6 +1439,7 @@ class IMAPSSLinitMixIn(CertMixIn):
         ca_certs = check_ca_certs(self.conf)
         ssl_version = check_ssl_version(self.conf)
         ssl_ciphers = check_ssl_ciphers(self.conf)
+        prefer = check_address_preference(self.conf)
         using_extended_certs_interface = False
         try:
             if ca_certs or ssl_version or ssl_ciphers:
@@ -705,7 +1464,7 @@ class IMAPSSLinitMixIn(CertMixIn):
                 )
                 self.conn = IMAP4_SSL_EXTENDED(
                     self.conf['server'], self.conf['port'], keyfile, certfile,
-                    ssl_version, ca_certs, ssl_ciphers
+                    ssl_version, ca_certs, ssl_ciphers, prefer=prefer
                 )
             elif keyfile:
                 self.log.trace(
@@ -716,15 +1475,19 @@ class IMAPSSLinitMixIn(CertMixIn):
                     + os.linesep
                 )
                 self.conn = IMAP4_SSL_EXTENDED(
-                    self.conf['server'], self.conf['port'], keyfile, certfile
+                    self.conf['server'], self.conf['port'], keyfile, certfile,
+                    prefer=prefer
                 )
             else:
                 self.log.trace(
                     'establishing IMAP SSL connection to %s:%d'
                     % (self.conf['server'], self.conf['port']) + os.linesep
                 )
-                self.conn = imaplib.IMAP4_SSL(self.conf['server'],
-                                              self.conf['port'])
+                self.conn = IMAP4_SSL_RACING(
+                    self.conf['server'], self.conf['port'],
+                    ssl_context=tls_context((self.conf['server'],
+                                             self.conf['port'])),
+                    prefer=prefer)
             ssl_cipher, actual_hash = self.ssl_cipher_hash()
         except imaplib.IMAP4.error as o:
             raise getmailOperationError('IMAP error (%s)' % o)
@@ -817,6 +1580,11 @@ class RetrieverSkeleton(ConfigurableBase):
       showconf(self) - should invoke self.log.info() to display the
                                 configuration of the class instance.
 
+      prefetch(self, msgids) - hint which messages are going to be retrieved
+                               next, in order.  Retrievers able to fetch
+                               several messages in one round trip use this;
+                               the default does nothing.
+
     Sub-classes may also wish to extend or over-ride the following base class
     methods:
 
@@ -851,6 +1619,19 @@ class RetrieverSkeleton(ConfigurableBase):
         self.deleted = {}
         self.mailbox_selected = False
 
+    def _connected(self):
+        '''Keep the time taken by each phase of connecting in self.timings,
+        the rest up to now being the greeting, and log them.
+        '''
+        self.timings = dict(self.conn.timings)
+        self.timings['greeting'] = max(
+            0.0,
+            time.monotonic() - self.conn.started - sum(self.timings.values()))
+        self.log.debug('connected in %s'
+                       % ', '.join('%s %.3fs' % item
+                                   for item in self.timings.items())
+                       + os.linesep)
+
     def setup_received(self, sock):
         serveraddr = sock.getpeername()
         if len(serveraddr) == 2:
@@ -1021,8 +1802,13 @@ class RetrieverSkeleton(ConfigurableBase):
     def delivered(self, msgid):
         self.__delivered[msgid] = None
         if self.app_options.get('to_oldmail_on_each_mail',False):
-            self.write_oldmailfile(self.mailbox_selected)
-            self.__delivered = {}
+            self.flush_oldmail()
+
+    def flush_oldmail(self):
+        '''Write the oldmail file; the delivered messages are in oldmail then.
+        '''
+        self.write_oldmailfile(self.mailbox_selected)
+        self.__delivered = {}
 
     def getheader(self, msgid):
         if not self.__initialized:
@@ -1054,6 +1840,9 @@ class RetrieverSkeleton(ConfigurableBase):
         self.deleted[msgid] = deleted
         return deleted
 
+    def prefetch(self, msgids):
+        pass
+
     def run_password_command(self):
         command = self.conf['password_command'][0]
         args = self.conf['password_command'][1:]
@@ -1081,11 +1870,108 @@ class POP3RetrieverBase(RetrieverSkeleton):
     def __init__(self, **args):
         RetrieverSkeleton.__init__(self, **args)
         self.log.trace()
+        self.capabilities = {}
+        self._pipelining = False
+        self._pending = collections.deque()
+
+    def _clear_state(self):
+        RetrieverSkeleton._clear_state(self)
+        self._usemsgtable(POP3MessageTable())
+        self._checkpoint = None
+        self._listedtail = False
+        self._prefetchqueue = []
+        self._prefetchpos = {}
+        self._prefetched = {}
+        self._sentpos = 0
+
+    def _capa(self):
+        '''Ask the server for its capabilities (RFC 2449); none if it does
+        not know CAPA.'''
+        try:
+            self.capabilities = self.conn.capa()
+        except poplib.error_proto as o:
+            self.log.debug('CAPA failed (%s)' % o + os.linesep)
+            self.capabilities = {}
+        self.log.debug('capabilities %s' % sorted(self.capabilities)
+                       + os.linesep)
+        return self.capabilities
+
+    def _pipeline(self, cmd, msgids):
+        '''Send cmd for each of msgids at once, without waiting for the
+        replies; _readpipelined() reads them in order.
+        '''
+        self.conn.sock.sendall(b''.join(
+            b'%s %d\r\n' % (cmd.encode(), self._getmsgnumbyid(msgid))
+            for msgid in msgids))
+        self._pending.extend((cmd, msgid) for msgid in msgids)
+        # Don't let DELE replies pile up unread on the server side
+        while len(self._pending) > 2 * self.conf['pop3_pipeline']:
+            self._readpipelined()
+
+    def _readpipelined(self):
+        '''Read the reply to the oldest pipelined command.  A RETR reply goes
+        to self._prefetched; a failed DELE ends the session, as it does
+        without pipelining.
+        '''
+        (cmd, msgid) = self._pending.popleft()
+        if cmd == 'DELE':
+            try:
+                self.conn._getresp()
+            except poplib.error_proto as o:
+                raise getmailOperationError(
+                    'POP error (DELE of msgid %s failed: %s)' % (msgid, o))
+            return
+        try:
+            self._prefetched[msgid] = self._readretr()
+        except poplib.error_proto as o:
+            self._prefetched[msgid] = o
+
+    def _readretr(self):
+        # The reply to RETR, as (response, data, octets); see
+        # pop3_read_multiline()
+        response = self.conn._getresp()
+        return (response, ) + pop3_read_multiline(
+            self.conn, self.conf.get('pop3_spool_threshold', 0))
+
+    def _flushpipeline(self):
+        '''Read all outstanding replies, before sending a command that waits
+        for its own.'''
+        while self._pending:
+            self._readpipelined()
+
+    def prefetch(self, msgids):
+        # With pop3_pipeline, RETR commands for these are sent ahead
+        self._prefetchqueue = list(msgids)
+        self._prefetchpos = dict(
+            (msgid, i) for (i, msgid) in enumerate(self._prefetchqueue)
+        )
+        self._sentpos = 0
+
+    def _retrpipelined(self, msgid):
+        # Keep RETR commands going for msgid and up to pop3_pipeline-1
+        # messages queued after it, and return the reply for msgid.
+        # Replies for messages before it were skipped by go().
+        pos = self._prefetchpos[msgid]
+        self._sentpos = max(self._sentpos, pos)
+        end = min(pos + self.conf['pop3_pipeline'], len(self._prefetchqueue))
+        if self._sentpos < end:
+            self._pipeline('RETR', self._prefetchqueue[self._sentpos:end])
+            self._sentpos = end
+        while msgid not in self._prefetched:
+            self._readpipelined()
+        for skipped in [m for m in self._prefetched
+                        if self._prefetchpos.get(m, -1) < pos]:
+            del self._prefetched[skipped]
+        reply = self._prefetched.pop(msgid)
+        if isinstance(reply, poplib.error_proto):
+            raise reply
+        return reply
 
     def select_mailbox(self, mailbox):
         assert mailbox is None, (
             'POP does not support mailbox selection (%s)' % mailbox
         )
+        self._flushpipeline()
         if self.mailbox_selected is not False:
             self.write_oldmailfile(self.mailbox_selected)
 
@@ -1103,13 +1989,151 @@ class POP3RetrieverBase(RetrieverSkeleton):
             raise getmailOperationError('no such message ID %s' % msgid)
         return self.msgnum_by_msgid[msgid]
 
+    def _checkpointfile(self):
+        return self.oldmail_filename + '.checkpoint'
+
+    def _checkpointusable(self):
+        '''Messages seen in an earlier session need not be listed again
+        only if none of them is to be retrieved or deleted now.
+        '''
+        return (self.conf.get('pop3_checkpoint', False)
+                and not self.app_options.get('read_all', True)
+                and not self.app_options.get('delete', False)
+                and not self.app_options.get('delete_after', 0)
+                and not self.app_options.get('delete_bigger_than', 0))
+
+    def _readcheckpoint(self):
+        '''Return the message count, octets and UIDL of the last message
+        of the maildrop at the start of the last session, which left nothing
+        behind to retrieve; None if there is no such checkpoint.
+        '''
+        try:
+            with open(self._checkpointfile()) as f:
+                (count, octets, msgid) = f.read().splitlines()
+            return (int(count), int(octets), msgid)
+        except (IOError, ValueError):
+            return None
+
+    def _writecheckpoint(self):
+        '''Remember the maildrop at the start of this session if all of its
+        messages were retrieved (or are too large to be), and forget the
+        checkpoint otherwise.
+        '''
+        maxsize = self.app_options.get('max_message_size', 0)
+        pending = [
+            msgid for msgid in self.msgsizes
+            if msgid not in self.oldmail and not self.deleted.get(msgid)
+            and not (maxsize and self.msgsizes[msgid] > maxsize)
+        ]
+        filename = self._checkpointfile()
+        if pending:
+            self.log.debug('%d messages left, no checkpoint' % len(pending)
+                           + os.linesep)
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            return
+        checkpointfile = None
+        try:
+            checkpointfile = updatefile(filename)
+            for line in self._checkpoint:
+                checkpointfile.write('%s%s' % (line, os.linesep))
+            checkpointfile.close()
+        except IOError as o:
+            self.log.error('failed writing checkpoint for %s (%s)'
+                           % (self, o) + os.linesep)
+            if checkpointfile:
+                checkpointfile.abort()
+
+    def write_oldmailfile(self, mailbox):
+        RetrieverSkeleton.write_oldmailfile(self, mailbox)
+        if self._checkpoint is not None:
+            self._writecheckpoint()
+
+    def _probe(self, cmd, msgnum):
+        '''Return the second argument of the reply to UIDL or LIST for one
+        message.'''
+        return self.conn._shortcmd('%s %d' % (cmd, msgnum)).split()[2]
+
+    def _getmsglist_checkpoint(self, count, octets):
+        '''List only the messages appended since the last session, with a
+        UIDL and LIST per message, if that session left nothing behind to
+        retrieve.  The maildrop is taken as only appended to if the message
+        that was last then still is at the same position, and the octets
+        add up.  Returns False if the whole maildrop needs to be listed.
+        '''
+        saved = self._readcheckpoint()
+        if saved is None:
+            return False
+        (savedcount, savedoctets, lastmsgid) = saved
+        if not 0 <= count - savedcount <= POP3_CHECKPOINT_PROBES:
+            return False
+        table = POP3MessageTable()
+        try:
+            if savedcount and (self._probe('UIDL', savedcount).decode()
+                               .replace('/', '-') != lastmsgid):
+                return False
+            for msgnum in range(savedcount + 1, count + 1):
+                msgid = self._probe('UIDL', msgnum).decode().replace('/', '-')
+                if not table.add(msgnum, msgid,
+                                 int(self._probe('LIST', msgnum))):
+                    return False
+                lastmsgid = msgid
+        except (poplib.error_proto, IndexError, ValueError) as o:
+            self.log.debug('listing appended messages failed (%s)' % o
+                           + os.linesep)
+            return False
+        if savedoctets + sum(table.sizes) != octets:
+            return False
+        self.log.debug('%d messages appended since last session'
+                       % len(table) + os.linesep)
+        self._usemsgtable(table)
+        self._checkpoint = (count, octets, lastmsgid)
+        self._listedtail = True
+        return True
+
+    def _usemsgtable(self, table):
+        '''Make table, a POP3MessageTable, the list of available messages.'''
+        self._msgtable = table
+        self.msgnum_by_msgid = table.msgnum_by_msgid
+        self.msgid_by_msgnum = table.msgid_by_msgnum
+        self.msgsizes = table.msgsizes
+        self.sorted_msgnum_msgid = table.sorted_msgnum_msgid
+
+    def _prunevanished(self):
+        '''Remove messages from state file that are no longer in mailbox,
+        but only if the timestamp for them are old (30 days for now).
+        This is because IMAP users can have one state file but multiple
+        IMAP folders in different configuration rc files.
+        '''
+        for msgid in list(self.oldmail.keys()):
+            timestamp = self.oldmail[msgid]
+            age = self.timestamp - timestamp
+            if msgid not in self.msgsizes and age > VANISHED_AGE:
+                self.log.debug('removing vanished old message id %s' % msgid
+                               + os.linesep)
+                del self.oldmail[msgid]
+
     def _getmsglist(self):
         self.log.trace()
+        table = POP3MessageTable()
+        duplicates = []
+        stat = None
         try:
-            (response, msglist, octets) = self.conn.uidl()
-            self.log.debug('UIDL response "%s", %d octets'
-                           % (response, octets) + os.linesep)
-            for (i, line) in enumerate(msglist):
+            if self._checkpointusable():
+                stat = self.conn.stat()
+                self.log.debug('STAT %d messages, %d octets' % stat
+                               + os.linesep)
+                if self._getmsglist_checkpoint(*stat):
+                    self.gotmsglist = True
+                    return
+            # UIDL and LIST are parsed as they are read; for maildrops of
+            # hundreds of thousands of messages, lists of their lines would
+            # take more memory than the table itself.
+            self.conn._putcmd('UIDL')
+            response = self.conn._getresp()
+            for (i, line) in enumerate(pop3_iter_multiline(self.conn)):
                 try:
                     (msgnum, msgid) = line.decode().split(None, 1)
                     # Don't allow / in UIDs we store, as we look for that to
@@ -1125,50 +2149,42 @@ class POP3RetrieverBase(RetrieverSkeleton):
                         % (self, i)
                     )
                 msgnum = int(msgnum)
-                if msgid in self.msgnum_by_msgid:
+                if not table.add(msgnum, msgid):
                     # UIDL "unique" identifiers weren't unique.
                     # Server is broken.
-                    if self.conf.get('delete_dup_msgids', False):
-                        self.log.debug('deleting message %s with duplicate '
-                                       'msgid %s' % (msgnum, msgid)
-                                       + os.linesep)
-                        self.conn.dele(msgnum)
-                    else:
+                    if not self.conf.get('delete_dup_msgids', False):
                         raise getmailOperationError(
                             '%s does not uniquely identify messages '
                             '(got %s twice) -- see documentation or use '
                             'BrokenUIDLPOP3Retriever instead'
                             % (self, msgid)
                         )
-                else:
-                    self.msgnum_by_msgid[msgid] = msgnum
-                    self.msgid_by_msgnum[msgnum] = msgid
-            self.log.debug('Message IDs: %s'
-                           % list(sorted(self.msgnum_by_msgid.keys())) + os.linesep)
-            self.sorted_msgnum_msgid = sorted(self.msgid_by_msgnum.items())
-            (_, msglist, _) = self.conn.list()
-            for line in msglist:
-                tostrline = line.decode()
-                msgnum = int(tostrline.split()[0])
-                msgsize = int(tostrline.split()[1])
-                msgid = self.msgid_by_msgnum.get(msgnum, None)
-                # If no msgid found, it's a message that wasn't in the UIDL
-                # response above.  Ignore it and we'll get it next time.
-                if msgid is not None:
-                    self.msgsizes[msgid] = msgsize
-
-            # Remove messages from state file that are no longer in mailbox,
-            # but only if the timestamp for them are old (30 days for now).
-            # This is because IMAP users can have one state file but multiple
-            # IMAP folders in different configuration rc files.
-            for msgid in list(self.oldmail.keys()):
-                timestamp = self.oldmail[msgid]
-                age = self.timestamp - timestamp
-                if msgid not in self.msgsizes and age > VANISHED_AGE:
-                    self.log.debug('removing vanished old message id %s' % msgid
-                                   + os.linesep)
-                    del self.oldmail[msgid]
-
+                    duplicates.append((msgnum, msgid))
+            self.log.debug('UIDL response "%s", %d messages'
+                           % (response, len(table)) + os.linesep)
+            for (msgnum, msgid) in duplicates:
+                self.log.debug('deleting message %s with duplicate '
+                               'msgid %s' % (msgnum, msgid)
+                               + os.linesep)
+                self.conn.dele(msgnum)
+            table.sort()
+            if self.log.enabled(DEBUG):
+                self.log.debug('Message IDs: %s'
+                               % sorted(table.msgids) + os.linesep)
+            self.conn._putcmd('LIST')
+            self.conn._getresp()
+            for line in pop3_iter_multiline(self.conn):
+                (msgnum, msgsize) = line.split()[:2]
+                # If the message wasn't in the UIDL response above, it is
+                # ignored and we'll get it next time.
+                table.setsize(int(msgnum), int(msgsize))
+            self._usemsgtable(table)
+            if stat and not duplicates:
+                (count, octets) = stat
+                self._checkpoint = (
+                    count, octets, table.msgid_by_msgnum.get(count, ''))
+
+            self._prunevanished()
         except poplib.error_proto as o:
             raise getmailOperationError(
                 'POP error (%s) - if your server does not support the UIDL '
@@ -1180,7 +2196,10 @@ class POP3RetrieverBase(RetrieverSkeleton):
     def _flagmsgbyid(self, msgid):
         self.log.trace()
         msgnum = self._getmsgnumbyid(msgid)
-        self.conn.dele(msgnum)
+        if self._pipelining:
+            self._pipeline('DELE', [msgid])
+        else:
+            self.conn.dele(msgnum)
         return True
 
     def _getmsgbyid(self, msgid):
@@ -1188,10 +2207,21 @@ class POP3RetrieverBase(RetrieverSkeleton):
         msgnum = self._getmsgnumbyid(msgid)
         self.log.debug('msgnum %i' % msgnum + os.linesep)
         try:
-            response, lines, octets = self.conn.retr(msgnum)
+            if self._pipelining and msgid in self._prefetchpos:
+                response, data, octets = self._retrpipelined(msgid)
+            else:
+                self._flushpipeline()
+                self.conn._putcmd('RETR %s' % msgnum)
+                response, data, octets = self._readretr()
             self.log.debug('RETR response "%s", %d octets'
                            % (response, octets) + os.linesep)
-            msg = Message(fromlines=lines+[b''])
+            if not isinstance(data, bytes):
+                # Spooled to disk, see pop3_spool_threshold
+                msg = Message(fromspool=data)
+            elif data:
+                msg = Message(fromstring=data)
+            else:
+                msg = Message(fromlines=[data])
             return msg
         except poplib.error_proto as o:
             raise getmailRetrievalError(
@@ -1202,6 +2232,7 @@ class POP3RetrieverBase(RetrieverSkeleton):
     def _getheaderbyid(self, msgid):
         self.log.trace()
         msgnum = self._getmsgnumbyid(msgid)
+        self._flushpipeline()
         _, headerlist, _ = self.conn.top(msgnum, 0)
         parser = Parser.BytesHeaderParser()
         return parser.parsebytes(os.linesep.encode().join(headerlist))
@@ -1246,13 +2277,17 @@ class POP3RetrieverBase(RetrieverSkeleton):
             else:
                 self.conn.user(self.conf['username'])
                 self.conn.pass_(self.conf['password'])
+            if self.conf.get('pop3_pipeline', 0) > 0:
+                self._pipelining = 'PIPELINING' in self._capa()
             self._getmsglist()
-            self.log.debug('msgids: %s'
-                           % list(sorted(self.msgnum_by_msgid.keys())) + os.linesep)
-            self.log.debug('msgsizes: %s' % self.msgsizes + os.linesep)
-            # Remove messages from state file that are no longer in mailbox
+            if self.log.enabled(DEBUG):
+                self.log.debug('msgids: %s'
+                               % sorted(self.msgnum_by_msgid.keys()) + os.linesep)
+                self.log.debug('msgsizes: %s' % self.msgsizes + os.linesep)
+            # Remove messages from state file that are no longer in mailbox,
+            # unless only those appended since the last session were listed
             for msgid in list(self.oldmail.keys()):
-                if msgid not in self.msgsizes:
+                if msgid not in self.msgsizes and not self._listedtail:
                     self.log.debug('removing vanished message id %s' % msgid
                                    + os.linesep)
                     del self.oldmail[msgid]
@@ -1265,6 +2300,11 @@ class POP3RetrieverBase(RetrieverSkeleton):
         if not self.conn:
             return
         try:
+            while self._pending:
+                try:
+                    self._readpipelined()
+                except getmailOperationError:
+                    pass
             self.conn.rset()
             self.conn.quit()
         except (poplib.error_proto, socket.error) as o:
@@ -1277,6 +2317,7 @@ class POP3RetrieverBase(RetrieverSkeleton):
         if not self.conn:
             return
         try:
+            self._flushpipeline()
             self.conn.quit()
         except (poplib.error_proto, socket.error) as o:
             raise getmailOperationError('POP error (%s)' % o)
@@ -1356,6 +2397,22 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         self.gss_step = 0
         self.gss_vc = None
         self.gssapi = False
+        self.qresync = False
+        self._mboxstatuses = {}
+        self._idling = False
+        self._idleuidmax = 0
+        self._idlenews = {'uids': set()}
+        self._exists = None
+        self._idletag = None
+        self._idlepending = False
+        self._idletimeout = None
+        self.idle_deadline = None
+        self._notifying = False
+        self.notified = set()
+        self._pool = None
+        self._mainconn = None
+        self._filelock = threading.Lock()
+        self._quirks = set()
 
     def _clear_state(self):
         RetrieverSkeleton._clear_state(self)
@@ -1370,6 +2427,19 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         self.oldmail = {}
         self.__delivered = {}
         self._uidmax = 1
+        self._uidmax_changed = False
+        self._prefetchqueue = []
+        self._prefetchpos = {}
+        self._prefetched = {}
+        self._highestmodseq = None
+        self._selectstatus = {}
+        self._qresyncing = False
+        self._idling = False
+        self._idleuidmax = 0
+        self._idlenews = {'uids': set()}
+        self._exists = None
+        self._deletequeue = []
+        self._expunged = False
 
     def checkconf(self):
         RetrieverSkeleton.checkconf(self)
@@ -1418,9 +2488,9 @@ class IMAPRetrieverBase(RetrieverSkeleton):
             if cmd == 'login':
                 #raise getmailOperationError('IMAP login failed with: %s.\n'%str(o))
                 try:
-                    user, password = self.conf['username'], self.conf['password']
-                    result, resplist = self.conn.authenticate('PLAIN', lambda x: f'\0{user}\0{password}'.encode('utf-8'))
+                    result, resplist = self._authenticate_plain()
                     cmd = "authenticate"
+                    self._quirks.add('authenticate')
                 except (imaplib.IMAP4.error, UnicodeEncodeError) as oa:
                     raise getmailOperationError(
                         'IMAP login failed with: %s.\n\
@@ -1447,6 +2517,21 @@ class IMAPRetrieverBase(RetrieverSkeleton):
 
         return resplist
 
+    def _authenticate_plain(self):
+        '''AUTHENTICATE PLAIN, in one round trip if the server has SASL-IR
+        (RFC 4959).'''
+        user, password = self.conf['username'], self.conf['password']
+        response = f'\0{user}\0{password}'.encode('utf-8')
+        if 'SASL-IR' not in self.conn.capabilities:
+            return self.conn.authenticate('PLAIN', lambda x: response)
+        result, resplist = self.conn._simple_command(
+            'AUTHENTICATE', 'PLAIN', base64.b64encode(response).decode())
+        if result != 'OK':
+            raise imaplib.IMAP4.error(
+                resplist[-1].decode('utf-8', 'replace'))
+        self.conn.state = 'AUTH'
+        return result, resplist
+
     def _parse_imapuidcmdresponse(self, cmd, *args):
         self.log.trace()
         try:
@@ -1468,52 +2553,205 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         return resplist
 
     def _parse_imapattrresponse(self, line):
-        self.log.trace('parsing attributes response line %s' % line
-                       + os.linesep)
-        r = {}
+        # No trace logging here, this runs for every message in the listing
         try:
-            parts = line[line.index(b'(') + 1:line.rindex(b')')].split()
-            while parts:
-                # Flags starts a parenthetical list of valueless flags
-                if parts[0].lower() == b'flags' and parts[1].startswith(b'('):
-                    while parts and not parts[0].endswith(b')'):
-                        del parts[0]
-                    if parts:
-                        # Last one, ends with ")"
-                        del parts[0]
-                    continue
-                if len(parts) == 1:
-                    # Leftover part -- not name, value pair.
-                    raise ValueError
-                name = parts.pop(0).lower()
-                r[name.decode()] = parts.pop(0).decode()
-        except (ValueError, IndexError, AttributeError) as o:
+            return imap_parse_fetch(line)
+        except (ValueError, AttributeError) as o:
             raise getmailOperationError(
                 'IMAP error (failed to parse attr response line "%s": %s)'
                 % (line, o)
             )
-        self.log.trace('got %s' % r + os.linesep)
-        return r
 
     def id(self):
         server_id = self.conn.id('name', 'getmail', 'version', '6.0.0')
         return server_id
 
+    def enable_qresync(self):
+        '''Enable QRESYNC (RFC 7162) for the session, if the server has it.'''
+        if not ('QRESYNC' in self.conn.capabilities
+                and 'ENABLE' in self.conn.capabilities):
+            self.log.debug('server does not support QRESYNC' + os.linesep)
+            return
+        try:
+            self._parse_imapcmdresponse('enable', 'QRESYNC')
+            self.qresync = True
+        except getmailOperationError as o:
+            self.log.warning('enabling QRESYNC failed (%s)' % o + os.linesep)
+
+    def enable_compress(self):
+        '''Compress the session with COMPRESS=DEFLATE (RFC 4978), if the
+        server has it.
+        '''
+        if 'COMPRESS=DEFLATE' not in self.conn.capabilities:
+            self.log.debug('server does not support COMPRESS=DEFLATE'
+                           + os.linesep)
+            return
+        imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+        try:
+            self._parse_imapcmdresponse('_simple_command', 'COMPRESS',
+                                        'DEFLATE')
+        except getmailOperationError as o:
+            self.log.warning('enabling COMPRESS failed (%s)' % o + os.linesep)
+            return
+        IMAPDeflate(self.conn)
+
     def list_mailboxes(self):
         '''List (selectable) IMAP folders in account.'''
-        cmd = ('LIST', )
-        resplist = self._parse_imapcmdresponse(*cmd)
+        resplist = None
+        if (self._skipusable(self._read_only())
+                and 'LIST-STATUS' in self.conn.capabilities):
+            resplist = self._list_status()
+        if resplist is None:
+            cmd = ('LIST', )
+            resplist = self._parse_imapcmdresponse(*cmd)
         return mailbox_names(
             codecs.decode(x,'imap4-utf-7')
             for x in resplist)
 
+    def _list_status(self):
+        '''LIST with RETURN (STATUS ...) (RFC 5819), to get the STATUS of all
+        mailboxes in the same round trip.  Returns None if that failed.
+        '''
+        try:
+            (typ, dat) = self.conn._simple_command(
+                'LIST', '""', '*',
+                'RETURN (STATUS (%s))' % ' '.join(self._statusitems()))
+            (typ, resplist) = self.conn._untagged_response(typ, dat, 'LIST')
+            (_, statuses) = self.conn.response('STATUS')
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as o:
+            typ = 'BAD %s' % o
+        if typ != 'OK':
+            self.log.debug('LIST-STATUS failed (%s), using LIST' % typ
+                           + os.linesep)
+            return None
+        self._storestatuses(statuses)
+        return resplist
+
+    def status_mailboxes(self, mailboxes):
+        '''Get the STATUS of the mailboxes that may be skipped as unchanged in
+        one round trip, pipelining the STATUS commands.
+        '''
+        if not self._skipusable(self._read_only()):
+            return
+        states = self._mboxstatereadall()
+        mailboxes = [
+            mailbox for mailbox in mailboxes
+            if mailbox not in self._mboxstatuses
+            and states.get(mailbox, {}).get('unretrieved') == '0'
+        ]
+        if len(mailboxes) < 2:
+            return
+        items = '(%s)' % ' '.join(self._statusitems())
+        tags = [self.conn._command('STATUS', self.quote_mailbox(mailbox),
+                                   items)
+                for mailbox in mailboxes]
+        for tag in tags:
+            try:
+                self.conn._command_complete('STATUS', tag)
+            except imaplib.IMAP4.abort:
+                raise
+            except imaplib.IMAP4.error as o:
+                self.log.debug('STATUS failed (%s)' % o + os.linesep)
+        self._storestatuses(self.conn.response('STATUS')[1])
+
+    def _storestatuses(self, data):
+        for line in data:
+            if isinstance(line, bytes) and line.rstrip().endswith(b')'):
+                self._mboxstatuses[imap_status_mailbox(line)] = (
+                    imap_parse_status([line]))
+
+    def _capabilitycachefile(self):
+        return self.oldmail_filename + '.capabilities'
+
+    def _cachedcapabilities(self):
+        '''Return the key identifying the server, and its post-login
+        capabilities and quirks if cached for that key in the last
+        imap_capability_cache_ttl seconds.
+
+        The key is made of the capabilities the server announced before
+        login and the hash of its certificate, so that the cache is not
+        used once either changes.
+        '''
+        ttl = self.conf['imap_capability_cache_ttl']
+        if ttl <= 0:
+            return None, None, set()
+        key = ' '.join(sorted(self.conn.capabilities))
+        if hasattr(self.conn.sock, 'getpeercert'):
+            key += ' %s' % hashlib.sha256(
+                self.conn.sock.getpeercert(True) or b'').hexdigest()
+        try:
+            with open(self._capabilitycachefile()) as f:
+                lines = f.read().splitlines()
+            if (len(lines) == 4 and lines[1] == key
+                    and 0 <= self.timestamp - int(lines[0]) < ttl):
+                return key, tuple(lines[2].split()), set(lines[3].split())
+        except (IOError, ValueError):
+            pass
+        return key, None, set()
+
+    def _cachecapabilities(self, key):
+        cachefile = None
+        try:
+            with self._filelock:
+                cachefile = updatefile(self._capabilitycachefile())
+                for line in ('%i' % self.timestamp, key,
+                             ' '.join(self.conn.capabilities),
+                             ' '.join(sorted(self._quirks))):
+                    cachefile.write(line + os.linesep)
+                cachefile.close()
+        except IOError as o:
+            self.log.error('failed writing capability cache (%s)' % o
+                           + os.linesep)
+            if cachefile:
+                cachefile.abort()
+
+    def _listcachefile(self):
+        return self.oldmail_filename + '.mailboxes'
+
+    def cached_mailboxes(self):
+        '''Return list_mailboxes(), from the cache file if that is younger than
+        imap_list_cache_ttl seconds.
+        '''
+        ttl = self.conf['imap_list_cache_ttl']
+        if ttl > 0:
+            try:
+                with open(self._listcachefile()) as f:
+                    lines = f.read().splitlines()
+                if lines and 0 <= self.timestamp - int(lines[0]) < ttl:
+                    self.log.debug('using cached mailbox list' + os.linesep)
+                    return lines[1:]
+            except (IOError, ValueError):
+                pass
+        mailboxes = self.list_mailboxes()
+        if ttl > 0:
+            cachefile = None
+            try:
+                cachefile = updatefile(self._listcachefile())
+                cachefile.write('%i%s' % (self.timestamp, os.linesep))
+                for mailbox in mailboxes:
+                    cachefile.write(mailbox + os.linesep)
+                cachefile.close()
+            except IOError as o:
+                self.log.error('failed writing mailbox list cache (%s)' % o
+                               + os.linesep)
+                if cachefile:
+                    cachefile.abort()
+        return mailboxes
+
     def close_mailbox(self):
+        if self.mailbox_selected is False:
+            # Skipped as unchanged, never selected
+            return
         # Close current mailbox so deleted mail is expunged.  One getmail
         # user had a buggy IMAP server that didn't do the automatic expunge,
         # so we do it explicitly here if we've deleted any messages.
-        if any(self.deleted):
-            self.conn.expunge()
+        # Writing the oldmail file deletes the queued messages first.
         self.write_oldmailfile(self.mailbox_selected)
+        if any(self.deleted) and not self._expunged:
+            self.conn.expunge()
+        self._mboxstatesave()
         # And clear some state
         self.mailbox_selected = False
         self.mailbox = None
@@ -1527,7 +2765,24 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         self.oldmail = {}
         self.__delivered = {}
         self._uidmax = 1
+        self._uidmax_changed = False
+        self._prefetchqueue = []
+        self._prefetchpos = {}
+        self._prefetched = {}
+        self._highestmodseq = None
+        self._selectstatus = {}
+        self._qresyncing = False
+        self._idling = False
+        self._idleuidmax = 0
+        self._idlenews = {'uids': set()}
+        self._exists = None
+        self._deletequeue = []
+        self._expunged = False
         self.conn.close()
+        if self.conn is not self._mainconn:
+            # Back to the pool for the next mailbox
+            self._pool.release(self.conn)
+            self.conn = self._mainconn
 
     def _uidoldfile(self):
         return self.conf['uid_cache'] and self.conf['uid_cache'].lower() == "true"
@@ -1567,20 +2822,22 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         if f:
             if not self._uidmax_changed or not self.uidvalidity:
                 return
-            uidcache = {}
-            try:
-                with open(f) as C:
-                    for line in C:
-                        mailbox, _, _ = line.split(" ")
-                        uidcache[mailbox] = line
-            except FileNotFoundError:
-                pass
-            uidvalidity = self.uidvalidity.replace(" ","_")
-            uidcache[self.mailbox] = " ".join(
-                (self.mailbox, uidvalidity, str(self._uidmax)))+"\n"
-            with open(f,"w") as C:
-                for line in uidcache.values():
-                    print(line, file=C, end="")
+            # Pool workers write it too
+            with self._filelock:
+                uidcache = {}
+                try:
+                    with open(f) as C:
+                        for line in C:
+                            mailbox, _, _ = line.split(" ")
+                            uidcache[mailbox] = line
+                except FileNotFoundError:
+                    pass
+                uidvalidity = self.uidvalidity.replace(" ","_")
+                uidcache[self.mailbox] = " ".join(
+                    (self.mailbox, uidvalidity, str(self._uidmax)))+"\n"
+                with open(f,"w") as C:
+                    for line in uidcache.values():
+                        print(line, file=C, end="")
     def _uidmaxset(self,uidvalidity,uid):
         if uid is None:
             self._uidmax = 1
@@ -1599,51 +2856,97 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         except ValueError:
             self._uidmax = 1
 
-    def select_quoted(self, mailbox, read_only = False):
+    def quote_mailbox(self, mailbox):
         if (len(mailbox) < 2 or (
             mailbox[0],mailbox[-1]) != ('"','"')
             ) and IMAP_ATOM_SPECIAL.search(mailbox):
-            mailbox_quoted =  _quote(mailbox)
-            return self.conn.select(
-                codecs.encode(mailbox_quoted,'imap4-utf-7'),
-                read_only)
-        else:
-            return self.conn.select(
-                codecs.encode(
-                    mailbox,
-                    'imap4-utf-7'),
-                read_only)
+            mailbox =  _quote(mailbox)
+        return codecs.encode(mailbox, 'imap4-utf-7')
+
+    def mailbox_status(self, mailbox, items):
+        '''Return the STATUS items of a mailbox as dict with lower case keys.
+        '''
+        return imap_parse_status(self._parse_imapcmdresponse(
+            'status', self.quote_mailbox(mailbox), '(%s)' % ' '.join(items)))
+
+    def select_quoted(self, mailbox, read_only = False, qresync = None):
+        mailbox = self.quote_mailbox(mailbox)
+        if qresync:
+            return self._select_qresync(mailbox, read_only, qresync)
+        return self.conn.select(mailbox, read_only)
+
+    def _select_qresync(self, mailbox, read_only, qresync):
+        '''SELECT or EXAMINE with the QRESYNC parameter (RFC 7162, 3.2.5),
+        which imaplib's select() cannot send.  qresync is the tuple
+        (uidvalidity, modseq) remembered from the last session.
+        '''
+        self.conn.untagged_responses = {}
+        self.conn.is_readonly = read_only
+        name = read_only and 'EXAMINE' or 'SELECT'
+        (typ, dat) = self.conn._simple_command(
+            name, mailbox, '(QRESYNC (%s %s))' % qresync)
+        if typ != 'OK':
+            self.conn.state = 'AUTH'
+            return typ, dat
+        self.conn.state = 'SELECTED'
+        return typ, self.conn.untagged_responses.get('EXISTS', [None])
 
     def select_mailbox(self, mailbox):
         self.log.trace()
         assert mailbox in self.mailboxes, (
             'mailbox not in config (%s)' % mailbox
         )
+        if self._idling and mailbox == self.mailbox_selected:
+            return self._refresh_mailbox()
         if self.mailbox_selected is not False:
             self.close_mailbox()
 
         self._clear_state()
+        prepared = self._pool and self._pool.take(mailbox)
+        if prepared:
+            return self._adopt(*prepared)
+
+        read_only = self._read_only()
+        if self._mailboxunchanged(mailbox, read_only):
+            self.log.debug('mailbox "%s" unchanged, not selecting'
+                           % mailbox + os.linesep)
+            self.gotmsglist = True
+            return 0
 
         if self.oldmail_exists(mailbox):
             self.read_oldmailfile(mailbox)
 
         self.log.debug('selecting mailbox "%s"' % mailbox + os.linesep)
         uidvalidity = None
+        state = {}
         try:
-            if (self.app_options['delete'] or self.app_options['delete_after']
-                    or self.app_options['delete_bigger_than']):
-                read_only = False
+            if self._qresyncusable(read_only):
+                state = self._mboxstateread(mailbox)
+            if state.get('highestmodseq'):
+                (status, msgcount) = self.select_quoted(
+                    mailbox, read_only,
+                    (state['uidvalidity'], state['highestmodseq']))
             else:
-                read_only = True
-            (status, msgcount) = self.select_quoted(mailbox, read_only)
+                (status, msgcount) = self.select_quoted(mailbox, read_only)
             if status == 'NO':
                 # Specified mailbox doesn't exist, no permissions, etc.
+                if self.conf['imap_list_cache_ttl'] > 0:
+                    # Maybe it was deleted, list the mailboxes again next time
+                    self._droplistcache()
                 raise getmailMailboxSelectError(mailbox)
 
             self.mailbox_selected = mailbox
             # use *last* EXISTS returned
             msgcount = int(msgcount[-1])
+            # Consumed; any later EXISTS means the mailbox changed
+            self.conn.untagged_responses.pop('EXISTS', None)
+            self._exists = msgcount
             uidvalidity = self.conn.response('UIDVALIDITY')[1][0]
+            self._highestmodseq = self.conn.response('HIGHESTMODSEQ')[1][-1]
+            uidnext = self.conn.response('UIDNEXT')[1][-1]
+            if uidnext:
+                self._selectstatus = {'messages': str(msgcount),
+                                      'uidnext': uidnext.decode()}
         except imaplib.IMAP4.error as o:
             raise getmailOperationError('IMAP error (%s)' % o)
         except (IndexError, ValueError) as o:
@@ -1657,27 +2960,437 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         self.uidvalidity = uidvalidity and uidvalidity.decode() or None
         imap_search = self.conf['imap_search']
         if imap_search:
-            result, data = self.conn.search(None, imap_search)
-            data = [d for d in data if d is not None]
-            if result == 'OK' and data:
-                datasplit = data[0].split()
-                SPLITTO=1
-                datasplitlen = len(datasplit)
-                datafetchstart = 0
-                while datafetchstart < datasplitlen:
-                    datafetchend = datafetchstart + SPLITTO
-                    msgs = b','.join(datasplit[datafetchstart:datafetchend])
-                    datafetchstart = datafetchend
-                    msgs = msgs.decode()
-                    self._getmsglist(msgs)
-                self.gotmsglist = True
+            self._getmsglist_search(imap_search)
+        elif (state.get('highestmodseq') and self._highestmodseq
+                and state['uidvalidity'] == self.uidvalidity):
+            self._getmsglist_qresync(state)
         else:
             self._uidmaxread()
             self._getmsglist(msgcount, start=self._uidmax)
             self._uidmaxwrite()
+        self._searchdeletes()
 
         return msgcount
 
+    def _adopt(self, state, result, error):
+        '''Take over a mailbox selected by an IMAPSessionPool worker.'''
+        if error is not None:
+            self._pool.release(state['conn'])
+            raise error
+        for name in IMAP_MAILBOX_STATE:
+            if name in state:
+                setattr(self, name, state[name])
+        if self.mailbox_selected is False:
+            # Skipped as unchanged
+            self._pool.release(state['conn'])
+        else:
+            # Including what _searchdeletes() found to delete
+            self.conn = state['conn']
+        return result
+
+    def _searchdeletes(self):
+        '''With imap_search_policies, find what delete_after and
+        delete_bigger_than would delete with UID SEARCH BEFORE and LARGER,
+        and delete it at once, whether listed or not.  As in getmail, only
+        messages retrieved before (in the oldmail file) are deleted.
+        '''
+        if (not self.conf['imap_search_policies']
+                or self.app_options.get('only_oldmail_file')):
+            # getmail does not delete with only_oldmail_file either
+            return
+        days = self.app_options.get('delete_after')
+        bigger = self.app_options.get('delete_bigger_than')
+        if not (days or bigger):
+            return
+        prefix = '%s/' % self.uidvalidity
+        retrieved = [
+            (msgid, int(msgid[len(prefix):]), timestamp)
+            for (msgid, timestamp) in self.oldmail.items()
+            if msgid.startswith(prefix) and msgid[len(prefix):].isdigit()
+            and msgid not in self.deleted
+        ]
+        deletes = set()
+        if days and retrieved:
+            # A message arrived before it was retrieved; the margin is for
+            # the server's time zone, the oldmail timestamp decides.
+            before = self._searchuids('BEFORE %s' % time.strftime(
+                '%d-%b-%Y', time.gmtime(self.timestamp - (days - 2) * 86400)))
+            deletes.update(
+                msgid for (msgid, uid, timestamp) in retrieved
+                if (self.timestamp - timestamp) / 86400 >= days
+                and imap_inseqranges(before, uid)
+            )
+        if bigger and retrieved:
+            larger = self._searchuids('LARGER %d' % bigger)
+            deletes.update(msgid for (msgid, uid, _) in retrieved
+                           if imap_inseqranges(larger, uid))
+        if not deletes:
+            return
+        self.log.debug('deleting %d messages found by UID SEARCH'
+                       % len(deletes) + os.linesep)
+        deleted = 'Deleted' in self._ondelete()
+        for msgid in deletes:
+            self._deletequeue.append(int(msgid[len(prefix):]))
+            self.deleted[msgid] = deleted
+            # Done with, so getmail does not see them
+            self._mboxuids.pop(msgid, None)
+            self.msgnum_by_msgid.pop(msgid, None)
+            self.msgsizes.pop(msgid, None)
+        self._mboxuidorder = [msgid for msgid in self._mboxuidorder
+                              if msgid not in deletes]
+
+    def _endpool(self):
+        '''Stop the extra sessions; the current one is the only one then.'''
+        if self._pool is None:
+            return
+        (pool, self._pool) = (self._pool, None)
+        pool.close()
+        if self.conn is not self._mainconn:
+            pool._logout(self._mainconn)
+            self._mainconn = self.conn
+
+    def _checkpoint_mailbox(self):
+        '''Like close_mailbox(), but stay in the mailbox to IDLE in it.'''
+        responses = self.conn.untagged_responses
+        if ('EXISTS' in responses or 'EXPUNGE' in responses
+                or 'VANISHED' in responses):
+            # Changed while we were busy; message count unknown
+            self._exists = None
+        # Writing the oldmail file deletes the queued messages first
+        self.flush_oldmail()
+        if any(self.deleted) and not self._expunged:
+            (_, expunged) = self.conn.expunge()
+            if self._exists is not None and 'VANISHED' not in responses:
+                self._exists -= len([seq for seq in expunged if seq])
+            else:
+                self._exists = None
+        self._gathernotified(self.conn.untagged_responses)
+        self.conn.untagged_responses = {}
+        self._idleuidmax = max(
+            [int(uid) for uid in self._mboxuids.values()]
+            + [int(self._selectstatus.get('uidnext', 1)) - 1,
+               self._idleuidmax]
+        )
+        # From here on, the mailbox is not as it was when selected
+        self._selectstatus = {}
+        self._highestmodseq = None
+        self.deleted = {}
+        self.headercache = {}
+        self._expunged = False
+        self._idling = True
+
+    def _refresh_mailbox(self):
+        '''List the messages that arrived in the selected mailbox during IDLE,
+        without selecting it again.
+        '''
+        self.log.trace()
+        self._idling = False
+        self.msgnum_by_msgid = {}
+        self.msgsizes = {}
+        self._mboxuids = {}
+        self._mboxuidorder = []
+        self._prefetchqueue = []
+        self._prefetchpos = {}
+        self._prefetched = {}
+        news = self._idlenews
+        self._idlenews = {'uids': set()}
+        start = self._idleuidmax + 1
+        imap_search = self.conf['imap_search']
+        if imap_search and news.get('flags'):
+            # Flags changed, but the server did not say of which messages
+            self._getmsglist_search(imap_search)
+        elif imap_search:
+            # New messages, and those whose flags changed
+            uids = ','.join(filter(None, (imap_seqset(news['uids']),
+                                          '%d:*' % start)))
+            self._getmsglist_search('UID %s %s' % (uids, imap_search))
+        elif (self._exists is not None and not news.get('expunged')
+                and news.get('exists', 0) > self._exists):
+            # The new messages are at the end
+            self._getmsglist('%d:%d' % (self._exists + 1, news['exists']))
+        else:
+            self._getmsglist('%d:*' % start, byuid=True)
+        self._uidmaxwrite()
+        if 'exists' in news:
+            self._exists = (None if news.get('expunged') else news['exists'])
+        # n:* also matches the message with the highest UID if that is < n
+        for msgid in self._mboxuidorder:
+            if (int(self._mboxuids[msgid]) < start
+                    and int(self._mboxuids[msgid]) not in news['uids']):
+                del self._mboxuids[msgid]
+                del self.msgnum_by_msgid[msgid]
+                del self.msgsizes[msgid]
+        self._mboxuidorder = [msgid for msgid in self._mboxuidorder
+                              if msgid in self._mboxuids]
+        self.gotmsglist = True
+        self.log.debug('%d new messages after IDLE'
+                       % len(self._mboxuidorder) + os.linesep)
+        return len(self._mboxuidorder)
+
+    def _gathernews(self):
+        '''Take the untagged responses the server sent during IDLE.  Returns
+        True if there may be messages to retrieve.
+        '''
+        responses = self.conn.untagged_responses
+        self.conn.untagged_responses = {}
+        self._gathernotified(responses)
+        news = self._idlenews
+        if 'EXPUNGE' in responses or 'VANISHED' in responses:
+            news['expunged'] = True
+        exists = [n for n in responses.get('EXISTS', []) if n]
+        if exists:
+            news['exists'] = int(exists[-1])
+        for line in responses.get('FETCH', []):
+            try:
+                uid = isinstance(line, bytes) and imap_parse_fetch(line).get('uid')
+            except (ValueError, AttributeError):
+                uid = None
+            if uid:
+                news['uids'].add(int(uid))
+            elif line:
+                news['flags'] = True
+        if 'exists' in news and (news.get('expunged') or self._exists is None
+                                 or news['exists'] > self._exists):
+            return True
+        if self.notified:
+            return True
+        # Changed flags can change what imap_search matches
+        return bool(self.conf['imap_search']
+                    and (news['uids'] or news.get('flags')))
+
+    def _gathernotified(self, responses):
+        '''Note the mailboxes NOTIFY sent a STATUS response for.'''
+        if not self.conf['imap_notify']:
+            return
+        for line in responses.get('STATUS', []):
+            if isinstance(line, bytes) and line.rstrip().endswith(b')'):
+                self.notified.add(imap_status_mailbox(line))
+
+    def _getmsglist_search(self, imap_search):
+        for uids in imap_seqset_chunks(self._searchuids(imap_search)):
+            try:
+                self._getmsglist(uids, byuid=True)
+            except getmailOperationError as o:
+                # Some servers choke on FETCH over a message set (#275);
+                # fall back to fetching the messages one by one.
+                self.log.debug('FETCH %s failed (%s), fetching one by one'
+                               % (uids, o) + os.linesep)
+                for (lo, hi) in imap_parse_seqset(uids):
+                    for uid in range(lo, hi + 1):
+                        self._getmsglist('%d' % uid, byuid=True)
+        self.gotmsglist = True
+
+    def _read_only(self):
+        return not (self.app_options['delete']
+                    or self.app_options['delete_after']
+                    or self.app_options['delete_bigger_than'])
+
+    def _searchpolicies(self):
+        '''Whether _searchdeletes() finds all messages to delete, so that the
+        messages seen in earlier sessions need not be listed for that.
+        '''
+        return (self.conf['imap_search_policies']
+                and not self.app_options['delete'])
+
+    def _droplistcache(self):
+        try:
+            os.remove(self._listcachefile())
+        except OSError:
+            pass
+
+    def _statusitems(self):
+        items = ['MESSAGES', 'UIDNEXT', 'UIDVALIDITY']
+        if self.conf['imap_search'] and 'CONDSTORE' in self.conn.capabilities:
+            # Flag changes can change which messages match
+            items.append('HIGHESTMODSEQ')
+        return items
+
+    def _skipusable(self, read_only):
+        '''An unchanged mailbox can only be skipped if no message that was
+        seen in an earlier session needs to be looked at again.
+        '''
+        # delete_after deletes more as time passes, even if the mailbox
+        # did not change
+        return (self.conf['imap_skip_unchanged']
+                and (read_only or (self._searchpolicies()
+                                   and not self.app_options['delete_after']))
+                and not self.app_options.get('read_all', True))
+
+    def _mailboxunchanged(self, mailbox, read_only):
+        '''Compare the STATUS of a mailbox with that at the start of the last
+        session, which left nothing behind to retrieve.
+        '''
+        if not self._skipusable(read_only):
+            return False
+        state = self._mboxstateread(mailbox)
+        if not state.get('uidnext') or state.get('unretrieved') != '0':
+            return False
+        items = self._statusitems()
+        if self.conf['imap_search'] and not (
+                'HIGHESTMODSEQ' in items and state.get('modseq')):
+            return False
+        status = self._mboxstatuses.pop(mailbox, None)
+        if status is None:
+            try:
+                status = self.mailbox_status(mailbox, items)
+            except getmailOperationError as o:
+                self.log.debug('STATUS %s failed (%s)' % (mailbox, o)
+                               + os.linesep)
+                return False
+        return all(status.get(item.lower()) == state.get(IMAP_STATUS_KEYS[item])
+                   for item in items)
+
+    def _qresyncusable(self, read_only):
+        '''Listing only new and changed messages is enough if no message
+        that was seen in an earlier session needs to be looked at again.
+        '''
+        return (self.qresync and (read_only or self._searchpolicies())
+                and not self.conf['imap_search']
+                and not self.app_options.get('read_all', True))
+
+    def _mboxstatefile(self):
+        return self.oldmail_filename + '.state'
+
+    def _mboxstatereadall(self):
+        '''Return the state saved in the last session as dict by mailbox.'''
+        states = {}
+        try:
+            with open(self._mboxstatefile()) as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\0')
+                    states[fields[0]] = dict(
+                        field.split('=', 1) for field in fields[1:]
+                        if '=' in field)
+        except IOError:
+            pass
+        return states
+
+    def _mboxstateread(self, mailbox):
+        '''Return the state saved for a mailbox in the last session as dict.
+        '''
+        return self._mboxstatereadall().get(mailbox, {})
+
+    def _mboxstatewrite(self, mailbox, state):
+        '''Save the state for a mailbox, keeping that of other mailboxes.
+        An empty state removes the mailbox.
+        '''
+        filename = self._mboxstatefile()
+        lines = {}
+        try:
+            with open(filename) as f:
+                for line in f:
+                    lines[line.split('\0', 1)[0]] = line
+        except IOError:
+            pass
+        if state:
+            lines[mailbox] = '\0'.join(
+                [mailbox] + ['%s=%s' % kv for kv in sorted(state.items())]
+            ) + '\n'
+        else:
+            lines.pop(mailbox, None)
+        statefile = None
+        try:
+            statefile = updatefile(filename)
+            for line in lines.values():
+                statefile.write(line)
+            statefile.close()
+        except IOError as o:
+            self.log.error('failed writing state file for %s:%s (%s)'
+                           % (self, mailbox, o) + os.linesep)
+            if statefile:
+                statefile.abort()
+
+    def _getmsglist_qresync(self, state):
+        '''List only the messages that are new or changed since the last
+        session, plus those listed then but not retrieved (RFC 7162).
+        The UIDs of expunged messages came with the SELECT response as
+        VANISHED (EARLIER) and are dropped from the oldmail state.
+        '''
+        self.log.trace()
+        self._qresyncing = True
+        vanished = []
+        for line in self.conn.response('VANISHED')[1]:
+            m = line and IMAP_VANISHED.match(line)
+            if m:
+                vanished.extend(imap_parse_seqset(m.group(1)))
+        vanished.sort()
+        prefix = '%s/' % self.uidvalidity
+        for msgid in list(self.oldmail):
+            if (msgid.startswith(prefix) and msgid[len(prefix):].isdigit()
+                    and imap_inseqranges(vanished,
+                                         int(msgid[len(prefix):]))):
+                self.log.debug('removing vanished message id %s' % msgid
+                               + os.linesep)
+                del self.oldmail[msgid]
+        for uids in imap_seqset_chunks(imap_parse_seqset(
+                state.get('pending', ''))):
+            self._getmsglist(uids, byuid=True)
+        self._getmsglist('1:*', byuid=True,
+                         changedsince=state['highestmodseq'])
+        self.log.debug('%d messages new or changed since modseq %s'
+                       % (len(self._mboxuidorder), state['highestmodseq'])
+                       + os.linesep)
+        self.gotmsglist = True
+
+    def _mboxstatesave(self):
+        '''Remember for the next session the STATUS of the mailbox when it was
+        selected (imap_skip_unchanged), and HIGHESTMODSEQ along with the
+        listed messages that were neither retrieved nor deleted (imap_qresync).
+        '''
+        if not (self.mailbox and self.uidvalidity):
+            return
+        pending = [
+            msgid for msgid in self._mboxuidorder
+            if msgid not in self.oldmail and not self.deleted.get(msgid)
+        ]
+        read_only = self.conn.is_readonly
+        state = {}
+        if self._skipusable(read_only) and self._selectstatus:
+            maxsize = self.app_options.get('max_message_size', 0)
+            state.update(self._selectstatus)
+            state['unretrieved'] = str(len([
+                msgid for msgid in pending
+                if not (maxsize and self.msgsizes[msgid] > maxsize)
+            ]))
+            if self._highestmodseq:
+                state['modseq'] = self._highestmodseq.decode()
+        if (self.qresync and self._qresyncusable(read_only)
+                and self._highestmodseq):
+            state['highestmodseq'] = self._highestmodseq.decode()
+            state['pending'] = imap_seqset(
+                self._mboxuids[msgid] for msgid in pending)
+        if state:
+            state['uidvalidity'] = self.uidvalidity
+        if state or self._mboxstateread(self.mailbox):
+            self._mboxstatewrite(self.mailbox, state)
+
+    def _searchuids(self, criteria):
+        '''Run UID SEARCH and return the matching UIDs as [lo, hi] ranges.
+        With ESEARCH (RFC 4731) the server already sends them that way.
+        '''
+        if 'ESEARCH' in self.conn.capabilities:
+            try:
+                # * ESEARCH (TAG "A5") UID ALL 1:500,502,510:900
+                self._parse_imapuidcmdresponse('SEARCH', 'RETURN (ALL)',
+                                               criteria)
+                (_, data) = self.conn.response('ESEARCH')
+                for line in data:
+                    m = line and IMAP_ESEARCH_ALL.search(line)
+                    if m:
+                        return imap_parse_seqset(m.group(1))
+                return []
+            except (getmailOperationError, ValueError) as o:
+                self.log.debug('ESEARCH failed (%s), using plain UID SEARCH'
+                               % o + os.linesep)
+        try:
+            data = self._parse_imapuidcmdresponse('SEARCH', criteria)
+        except getmailOperationError as o:
+            self.log.warning('IMAP SEARCH %s failed (%s)' % (criteria, o)
+                             + os.linesep)
+            return []
+        data = [d for d in data if d is not None]
+        return imap_seqranges(b' '.join(data).split())
+
     def _remove_from_oldmail(self):
         # Remove messages from the oldmail state file that are no longer in mailbox,
         # but only if the timestamp for them are old (30 days for now).
@@ -1691,7 +3404,7 @@ class IMAPRetrieverBase(RetrieverSkeleton):
                                 + os.linesep)
                 del self.oldmail[msgid]
 
-    def _getmsglist(self, msgs, start=1):
+    def _getmsglist(self, msgs, start=1, byuid=False, changedsince=None):
         self.log.trace()
         try:
             if msgs:
@@ -1700,6 +3413,8 @@ class IMAPRetrieverBase(RetrieverSkeleton):
                 if start > 1:
                     fetchcmd=['UID', 'FETCH']
                     fetchcmd.append("%d:*"%(start+1))
+                elif byuid:
+                    fetchcmd=['UID', 'FETCH', msgs]
                 else:
                     fetchcmd=['FETCH']
                     if isinstance(msgs,str):
@@ -1709,6 +3424,8 @@ class IMAPRetrieverBase(RetrieverSkeleton):
                         remove_from_oldmail = True
                 fetchcmd.append(('(UID)' if self.app_options['skip_imap_fetch_size'] else
                                  '(UID RFC822.SIZE)'))
+                if changedsince:
+                    fetchcmd.append('(CHANGEDSINCE %s)' % changedsince)
                 response = self._parse_imapcmdresponse(*fetchcmd)
                 for line in response:
                     if not line:
@@ -1756,6 +3473,9 @@ class IMAPRetrieverBase(RetrieverSkeleton):
                     self._uidmaxset(self.uidvalidity, uid)
 
                     msgid = '%s/%s' % (self.uidvalidity, uid)
+                    if msgid in self._mboxuids:
+                        # Already listed (QRESYNC: pending and changed)
+                        continue
                     self._mboxuids[msgid] = r['uid']
                     self._mboxuidorder.append(msgid)
                     self.msgnum_by_msgid[msgid] = None
@@ -1774,29 +3494,68 @@ class IMAPRetrieverBase(RetrieverSkeleton):
 
     def _flagmsgbyid(self, msgid):
         self.log.trace()
-        try:
-            uid = self._getmboxuidbymsgid(msgid)
-            #self._selectmailbox(mailbox)
-            # Delete message
-            if self.conf['move_on_delete']:
-                self.log.debug('copying message to folder "%s"'
-                               % self.conf['move_on_delete'] + os.linesep)
-                response = self._parse_imapuidcmdresponse(
-                    'COPY', uid, self.conf['move_on_delete']
-                )
-            self.log.debug('deleting message "%s"' % uid + os.linesep)
+        # Queued; _flushdeletes() deletes them all at once
+        self._deletequeue.append(int(self._getmboxuidbymsgid(msgid)))
+        return 'Deleted' in self._ondelete()
 
-            # On GMail you need to remove LABELS before deleting
-            if 'X-GM-EXT-1' in self.conn.capabilities:
-                self._parse_imapuidcmdresponse('STORE', uid,'X-GM-LABELS', '()')
+    def _ondelete(self):
+        return self.conf.get('imap_on_delete',None) or r'(\Deleted \Seen)'
 
-            flag = self.conf.get('imap_on_delete',None) or r'(\Deleted \Seen)'
-            response = self._parse_imapuidcmdresponse(
-                'STORE', uid, 'FLAGS', flag
-            )
-            return 'Deleted' in flag
+    def write_oldmailfile(self, mailbox):
+        # Messages delete as before, when each was flagged right away.  The
+        # delivered ones are recorded even if deleting them fails, or they
+        # would all be delivered again.
+        try:
+            self._flushdeletes()
+        finally:
+            RetrieverSkeleton.write_oldmailfile(self, mailbox)
+
+    def _flushdeletes(self):
+        '''Delete (or flag with imap_on_delete) the queued messages, with a
+        few commands over UID sets.  Must come before the oldmail file is
+        written.  With UID MOVE (RFC 6851) or UID EXPUNGE (RFC 4315), only
+        these messages are expunged, and no EXPUNGE is needed afterwards.
+        '''
+        (uids, self._deletequeue) = (self._deletequeue, [])
+        if not uids:
+            return
+        flag = self._ondelete()
+        capabilities = self.conn.capabilities
+        move = ('Deleted' in flag and self.conf['move_on_delete']
+                and 'MOVE' in capabilities)
+        expunge = 'Deleted' in flag and 'UIDPLUS' in capabilities
+        if self.conf['move_on_delete'] and not move:
+            self.log.debug('copying %d messages to folder "%s"'
+                           % (len(uids), self.conf['move_on_delete'])
+                           + os.linesep)
+        self.log.debug('deleting %d messages' % len(uids) + os.linesep)
+        try:
+            for uidset in imap_seqset_chunks(imap_seqranges(uids)):
+                if move:
+                    self._parse_imapuidcmdresponse(
+                        'MOVE', uidset, self.conf['move_on_delete'])
+                    continue
+                if self.conf['move_on_delete']:
+                    self._parse_imapuidcmdresponse(
+                        'COPY', uidset, self.conf['move_on_delete'])
+                # On GMail you need to remove LABELS before deleting
+                if 'X-GM-EXT-1' in capabilities:
+                    self._parse_imapuidcmdresponse('STORE', uidset,
+                                                   'X-GM-LABELS', '()')
+                self._parse_imapuidcmdresponse('STORE', uidset, 'FLAGS', flag)
+                if expunge:
+                    self._parse_imapuidcmdresponse('EXPUNGE', uidset)
         except imaplib.IMAP4.error as o:
             raise getmailOperationError('IMAP error (%s)' % o)
+        if move or expunge:
+            self._expunged = True
+            responses = self.conn.untagged_responses
+            expunged = responses.pop('EXPUNGE', [])
+            if 'VANISHED' in responses:
+                responses.pop('VANISHED')
+                self._exists = None
+            elif self._exists is not None:
+                self._exists -= len([seq for seq in expunged if seq])
 
     def _getmsgpartbyid(self, msgid, part):
         self.log.trace()
@@ -1806,7 +3565,8 @@ class IMAPRetrieverBase(RetrieverSkeleton):
             self.log.debug('retrieving body for message "%s"' % uid
                            + os.linesep)
             try:
-                response = self._parse_imapuidcmdresponse('FETCH', uid, part)
+                response = self._parse_imapuidcmdresponse(
+                    'FETCH', uid, self._gmailpart(part))
             except (imaplib.IMAP4.error, getmailOperationError) as o:
                 # server gave a negative/NO response, most likely.  Bad server,
                 # no doughnut.
@@ -1835,27 +3595,111 @@ class IMAPRetrieverBase(RetrieverSkeleton):
                     sbody = None
                 if not sbody:
                     raise getmailRetrievalError('bad message from server!')
-                msg = Message(fromstring=sbody)
+                # The metadata may come before or after the literal
+                metadata = imap_parse_gmailmetadata(b' '.join(
+                    [response[0][0]] + [r for r in response[1:2]
+                                        if isinstance(r, bytes)]))
+                msg = self._makemsg(uid, sbody, metadata)
             except TypeError as o:
                 # response[0] is None instead of a message tuple
                 raise getmailRetrievalError('failed to retrieve msgid %s'
                                             % msgid)
+            return msg
+
+        except imaplib.IMAP4.error as o:
+            raise getmailOperationError('IMAP error (%s)' % o)
+
+    def _gmailpart(self, part):
+        # Have Gmail send the message metadata with the message
+        if 'X-GM-EXT-1' in self.conn.capabilities:
+            return '%s %s)' % (part[:-1], IMAP_GMAIL_ITEMS)
+        return part
+
+    def _makemsg(self, uid, sbody, metadata=None):
+        if isinstance(sbody, bytes):
+            msg = Message(fromstring=sbody)
+        else:
+            # Spooled to disk, see imap_spool_literals()
+            msg = Message(fromspool=sbody)
 
-            # record mailbox retrieved from in a header
-            if self.conf['record_mailbox']:
-                msg.add_header('X-getmail-retrieved-from-mailbox',
-                               tocode(self.mailbox_selected))
+        # record mailbox retrieved from in a header
+        if self.conf['record_mailbox']:
+            msg.add_header('X-getmail-retrieved-from-mailbox',
+                           tocode(self.mailbox_selected))
 
-            # google extensions: apply labels, etc
-            if 'X-GM-EXT-1' in self.conn.capabilities:
+        # google extensions: apply labels, etc
+        if 'X-GM-EXT-1' in self.conn.capabilities:
+            if metadata is None:
                 metadata = self._getgmailmetadata(uid, msg)
-                for (header, value) in metadata.items():
-                    msg.add_header(header, value)
+            for (header, value) in metadata.items():
+                msg.add_header(header, value)
 
-            return msg
+        return msg
 
-        except imaplib.IMAP4.error as o:
-            raise getmailOperationError('IMAP error (%s)' % o)
+    def _parse_fetchbodies(self, response):
+        # A FETCH response for several messages is a list of
+        # ('<n> (UID <uid> BODY[] {<size>}', '<literal>') tuples, each
+        # followed by the remainder of the response line, which may carry
+        # the UID (and Gmail metadata) instead if the server sent it after
+        # the literal.  Returns [uid, body, rest of response] lists.
+        bodies = []
+        for item in response:
+            if isinstance(item, tuple):
+                m = IMAP_FETCH_UID.search(item[0])
+                bodies.append([m and m.group(1).decode(), item[1], item[0]])
+            elif isinstance(item, bytes) and bodies:
+                bodies[-1][2] += b' ' + item
+                m = bodies[-1][0] is None and IMAP_FETCH_UID.search(item)
+                if m:
+                    bodies[-1][0] = m.group(1).decode()
+        return bodies
+
+    def prefetch(self, msgids):
+        if self.conf.get('imap_fetch_batch', 1) > 1:
+            self._prefetchqueue = list(msgids)
+            self._prefetchpos = dict(
+                (msgid, i) for (i, msgid) in enumerate(self._prefetchqueue)
+            )
+
+    def _fetchbatch(self, msgid, part):
+        # Fetch the bodies of msgid and the messages queued after it in one
+        # UID FETCH, limited by imap_fetch_batch messages and
+        # imap_fetch_batch_bytes octets.  Anything that goes wrong here is
+        # left to the per-message path.
+        batch = []
+        octets = 0
+        for queued in self._prefetchqueue[self._prefetchpos[msgid]:]:
+            size = self.msgsizes.get(queued, 0)
+            if batch and (len(batch) >= self.conf['imap_fetch_batch']
+                          or octets + size > self.conf['imap_fetch_batch_bytes']):
+                break
+            batch.append(queued)
+            octets += size
+        if len(batch) < 2:
+            return
+        msgid_by_uid = dict((self._mboxuids[m], m) for m in batch)
+        self.log.debug('retrieving bodies for %d messages (%d octets)'
+                       % (len(batch), octets) + os.linesep)
+        try:
+            response = self._parse_imapuidcmdresponse(
+                'FETCH', imap_seqset(msgid_by_uid),
+                self._gmailpart('(UID %s' % part[1:])
+            )
+        except (imaplib.IMAP4.error, getmailOperationError) as o:
+            self.log.debug('batched FETCH failed (%s), fetching messages one '
+                           'by one for the rest of the session' % o
+                           + os.linesep)
+            self._fetchbatch_broken = True
+            return
+        for (uid, sbody, rest) in self._parse_fetchbodies(response):
+            if sbody and uid in msgid_by_uid:
+                self._prefetched[msgid_by_uid[uid]] = (
+                    sbody, imap_parse_gmailmetadata(rest))
+        if msgid not in self._prefetched:
+            self.log.debug('batched FETCH response not understood, fetching '
+                           'messages one by one for the rest of the session'
+                           + os.linesep)
+            self._fetchbatch_broken = True
 
     def _getgmailmetadata(self, uid, msg):
         """
@@ -1877,24 +3721,12 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         if not response or not response[0]:
             return {}
 
-        ext = re.search(
-            b'X-GM-THRID (?P<THRID>\\d+) X-GM-MSGID (?P<MSGID>\\d+)'
-            b' X-GM-LABELS \\((?P<LABELS>.*)\\) UID',
-            response[0]
-        )
-        if not ext:
+        metadata = imap_parse_gmailmetadata(response[0])
+        if metadata is None:
             self.log.warning(
                 'Could not parse google imap extensions. Server said: %s'
                 % repr(response))
             return {}
-
-
-        results = ext.groupdict()
-        metadata = {}
-        for item in ('LABELS', 'THRID', 'MSGID'):
-            if results.get(item):
-                metadata['X-GMAIL-%s' % item] = results[item]
-
         return metadata
 
     def _getmsgbyid(self, msgid):
@@ -1903,6 +3735,14 @@ class IMAPRetrieverBase(RetrieverSkeleton):
             part = '(BODY.PEEK[])'
         else:
             part = '(RFC822)'
+        if (msgid in self._prefetchpos and self.conf.get('imap_fetch_batch', 1) > 1
+                and not self._fetchbatch_broken):
+            if msgid not in self._prefetched:
+                self._fetchbatch(msgid, part)
+            prefetched = self._prefetched.pop(msgid, None)
+            if prefetched:
+                return self._makemsg(self._getmboxuidbymsgid(msgid),
+                                     *prefetched)
         return self._getmsgpartbyid(msgid, part)
 
     def _getheaderbyid(self, msgid):
@@ -1916,6 +3756,8 @@ class IMAPRetrieverBase(RetrieverSkeleton):
     def initialize(self, options):
         self.log.trace()
         self.mailboxes = self.conf.get('mailboxes', ('INBOX', ))
+        # Set when a batched FETCH fails; not tried again this session
+        self._fetchbatch_broken = False
         # Handle password
         if ((self.conf.get('password', None) is None or self.conf['use_xoauth2'])
                 and not (HAVE_KERBEROS_GSS and self.conf['use_kerberos'])):
@@ -1930,45 +3772,8 @@ class IMAPRetrieverBase(RetrieverSkeleton):
 
         RetrieverSkeleton.initialize(self, options)
         try:
-            self.log.trace('trying self._connect()' + os.linesep)
-            self._connect()
-            try:
-                self.log.trace('logging in' + os.linesep)
-                if self.conf['use_kerberos'] and HAVE_KERBEROS_GSS:
-                    self.conn.authenticate('GSSAPI', self.gssauth)
-                elif self.conf['use_cram_md5']:
-                    self._parse_imapcmdresponse(
-                        'login_cram_md5', self.conf['username'],
-                        self.conf['password']
-                    )
-                elif self.conf['use_xoauth2']:
-                    # octal 1 / ctrl-A used as separator
-                    auth = 'user=%s\1auth=Bearer %s\1\1' % (self.conf['username'],
-                                                            self.conf['password'])
-                    self.conn.authenticate('XOAUTH2', lambda unused: auth)
-                else:
-                    self._parse_imapcmdresponse('login', self.conf['username'],
-                                                self.conf['password'])
-            except imaplib.IMAP4.abort as o:
-                raise getmailLoginRefusedError(o)
-            except imaplib.IMAP4.error as o:
-                if '[UNAVAILABLE]' in str(o):
-                    raise getmailLoginRefusedError(o)
-                else:
-                    raise getmailCredentialError(o)
-
-            self.log.trace('logged in' + os.linesep)
-            # Some IMAP servers change the available capabilities after
-            # authentication, i.e. they present a limited set before login.
-            # The Python stlib IMAP4 class doesn't take this into account
-            # and just checks the capabilities immediately after connecting.
-            # Force a re-check now that we've authenticated.
-            (_, dat) = self.conn.capability()
-            if dat == [None]:
-                # No response, don't update the stored capabilities
-                self.log.warning('no post-login CAPABILITY response from server\n')
-            else:
-                self.conn.capabilities = tuple(dat[-1].decode().upper().split())
+            self._login()
+            self._mainconn = self.conn
 
             if 'IDLE' in self.conn.capabilities:
                 self.supports_idle = True
@@ -1980,13 +3785,93 @@ class IMAPRetrieverBase(RetrieverSkeleton):
             if self.supports_id and self.conf['imap_id_extension']:
                 self.id()
 
+            if self.conf['imap_qresync']:
+                self.enable_qresync()
+            # NOTIFY is set up with the first IDLE of the session
+            self._notifying = False
+
             if self.mailboxes == ('ALL', ):
                 # Special value meaning all mailboxes in account
-                self.mailboxes = tuple(self.list_mailboxes())
+                self.mailboxes = tuple(self.cached_mailboxes())
+            self.status_mailboxes(self.mailboxes)
+            if self.conf['max_connections'] > 1 and len(self.mailboxes) > 1:
+                self._pool = IMAPSessionPool(
+                    self, min(self.conf['max_connections'],
+                              len(self.mailboxes)) - 1)
 
         except imaplib.IMAP4.error as o:
             raise getmailOperationError('IMAP error (%s)' % o)
 
+    def _login(self):
+        '''Connect and log in; self.conn is the authenticated session.'''
+        self.log.trace('trying self._connect()' + os.linesep)
+        self._connect()
+        (key, cached, quirks) = self._cachedcapabilities()
+        self._quirks |= quirks
+        resplist = None
+        try:
+            self.log.trace('logging in' + os.linesep)
+            if self.conf['use_kerberos'] and HAVE_KERBEROS_GSS:
+                self.conn.authenticate('GSSAPI', self.gssauth)
+            elif self.conf['use_cram_md5']:
+                resplist = self._parse_imapcmdresponse(
+                    'login_cram_md5', self.conf['username'],
+                    self.conf['password']
+                )
+            elif self.conf['use_xoauth2']:
+                # octal 1 / ctrl-A used as separator
+                auth = 'user=%s\1auth=Bearer %s\1\1' % (self.conf['username'],
+                                                        self.conf['password'])
+                self.conn.authenticate('XOAUTH2', lambda unused: auth)
+            elif 'authenticate' in self._quirks:
+                self.log.debug('using AUTHENTICATE PLAIN instead of LOGIN'
+                               + os.linesep)
+                (_, resplist) = self._authenticate_plain()
+            else:
+                resplist = self._parse_imapcmdresponse(
+                    'login', self.conf['username'], self.conf['password'])
+        except imaplib.IMAP4.abort as o:
+            raise getmailLoginRefusedError(o)
+        except imaplib.IMAP4.error as o:
+            if '[UNAVAILABLE]' in str(o):
+                raise getmailLoginRefusedError(o)
+            else:
+                raise getmailCredentialError(o)
+
+        self.log.trace('logged in' + os.linesep)
+        # Some IMAP servers change the available capabilities after
+        # authentication, i.e. they present a limited set before login.
+        # The Python stlib IMAP4 class doesn't take this into account
+        # and just checks the capabilities immediately after connecting.
+        # Force a re-check now that we've authenticated, unless the server
+        # sent them along with the login response or they are cached.
+        dat = self.conn.untagged_responses.pop('CAPABILITY', None)
+        for line in resplist or ():
+            match = (isinstance(line, bytes)
+                     and IMAP_CAPABILITY_CODE.search(line))
+            if match:
+                dat = [match.group(1)]
+        if not dat and cached:
+            self.log.debug('using cached capabilities' + os.linesep)
+            self.conn.capabilities = cached
+        else:
+            if not dat:
+                (_, dat) = self.conn.capability()
+            if dat == [None]:
+                # No response, don't update the stored capabilities
+                self.log.warning(
+                    'no post-login CAPABILITY response from server\n')
+            else:
+                self.conn.capabilities = tuple(
+                    dat[-1].decode().upper().split())
+        if key and (cached != self.conn.capabilities
+                    or quirks != self._quirks):
+            self._cachecapabilities(key)
+        if self.conf['imap_compress']:
+            self.enable_compress()
+        if self.conf['imap_spool_threshold'] > 0:
+            imap_spool_literals(self.conn, self.conf['imap_spool_threshold'])
+
     def abort(self):
         self.log.trace()
         RetrieverSkeleton.abort(self)
@@ -1998,58 +3883,122 @@ class IMAPRetrieverBase(RetrieverSkeleton):
             pass
         self.conn = None
 
-    def go_idle(self, idle_mailbox, timeout=300):
+    def go_idle(self, idle_mailbox, timeout=None):
         """Initiates IMAP's IDLE mode if the server supports it
 
         Waits until state of current mailbox changes, and then returns. Returns
         True if the connection still seems to be up, False otherwise.
 
+        If idle_mailbox is the selected mailbox, it stays selected, and the
+        next select_mailbox() for it lists only the messages that arrived
+        meanwhile.
+
         May throw getmailOperationError if the server refuses the IDLE setup
         (e.g. if the server does not support IDLE)
 
-        Default timeout is 5 minutes.
+        IDLE is renewed every timeout seconds, by default imap_idle_renew.
+        To wait on several connections at once, use idle_begin(),
+        idle_fileno() and idle_poll() instead.
         """
+        if not self.idle_begin(idle_mailbox, timeout):
+            return False
+        while True:
+            try:
+                if not self.idle_buffered():
+                    select.select([self.idle_fileno()], [], [],
+                                  max(0, self.idle_deadline - time.time()))
+            except KeyboardInterrupt:
+                # Stop IDLE mode before quitting
+                self.log.debug('IDLE mode cancelled\n')
+                self.idle_end()
+                raise
+            woken = self.idle_poll()
+            if woken is not None:
+                return woken
+
+    def idle_begin(self, idle_mailbox, timeout=None):
+        '''Enter IDLE mode in idle_mailbox, without waiting.  Returns False if
+        the connection failed.
 
+        Wait until idle_fileno() is readable or idle_deadline has passed, then
+        call idle_poll().
+        '''
         if not self.supports_idle:
             self.log.warning('IDLE not supported, so not idling\n')
             raise getmailOperationError(
                 'IMAP4 IDLE requested, but not supported by server'
             )
+        if timeout is None:
+            timeout = self.conf['imap_idle_renew']
+        self._idletimeout = timeout
+        self.notified = set()
 
-        # Based on current imaplib IDLE patch: http://bugs.python.org/issue11245
-        self.conn.untagged_responses = {}
-        self.select_quoted(idle_mailbox)
-        tag = self.conn._command('IDLE')
-        data = self.conn._get_response() # read continuation response
-
-        if data is not None:
-            raise getmailOperationError(
-                'IMAP4 IDLE requested, but server refused IDLE request: %s'
-                % data
-            )
+        try:
+            self._endpool()
+            if self.mailbox_selected == idle_mailbox:
+                self._checkpoint_mailbox()
+            else:
+                self.close_mailbox()
+                # Based on current imaplib IDLE patch: http://bugs.python.org/issue11245
+                self._gathernotified(self.conn.untagged_responses)
+                self.conn.untagged_responses = {}
+                self.select_quoted(idle_mailbox)
+                self.conn.untagged_responses = {}
+            if self.conf['imap_notify'] and not self._notifying:
+                self._notify(idle_mailbox)
+            self._idle_command()
+        except (imaplib.IMAP4.error, socket.error) as o:
+            # Treat as temporary failure
+            self.log.info('session aborted before IDLE (%s)\n' % o)
+            self._clear_state()
+            return False
+        return True
 
-        self.log.debug('Entering IDLE mode (server says "%s")\n'
-                       % self.conn.continuation_response)
+    def idle_fileno(self):
+        '''The socket to wait on during IDLE.'''
+        return self.conn.sock.fileno()
 
-        try:
-            aborted = None
-            (readable, _, _) = select.select([self.conn.sock], [], [], timeout)
-        except KeyboardInterrupt as o:
-            # Delay raising this until we've stopped IDLE mode
-            aborted = o
-
-        if aborted is not None:
-            self.log.debug('IDLE mode cancelled\n')
-        elif readable:
+    def idle_buffered(self):
+        '''Whether the server already sent news that were read from the
+        socket, so that waiting on idle_fileno() would miss them.
+        '''
+        return self._idlepending or (isinstance(self.conn.file, IMAPDeflate)
+                                     and self.conn.file.buffered())
+
+    def idle_poll(self):
+        '''End the IDLE command, after idle_fileno() became readable or
+        idle_deadline passed.  Returns True if the server reported what may be
+        new messages, False if the connection failed, and None if IDLE was
+        renewed.
+        '''
+        if time.time() < self.idle_deadline:
             # The socket has data waiting; server has updated status
             self.log.info('IDLE message received\n')
         else:
-            self.log.debug('IDLE timeout (%ds)\n' % timeout)
+            self.log.debug('IDLE timeout (%ds), renewing\n'
+                           % self._idletimeout)
+        if not self.idle_end():
+            self._clear_state()
+            return False
+        if self._gathernews():
+            return True
+        self.log.debug('nothing new to retrieve, continuing IDLE\n')
+        try:
+            self._idle_command()
+        except (imaplib.IMAP4.error, getmailOperationError, socket.error) as o:
+            # Only this connection is affected; it reconnects
+            self.log.info('connection lost during IDLE (%s)\n' % o)
+            self._clear_state()
+            return False
+        return None
 
+    def idle_end(self):
+        '''Send DONE and wait for the IDLE command to complete.  Returns False
+        if the connection failed.
+        '''
         try:
-            self.conn.untagged_responses = {}
             self.conn.send(b'DONE\r\n')
-            self.conn._command_complete('IDLE', tag)
+            self.conn._command_complete('IDLE', self._idletag)
         except ssl.SSLEOFError as o:
             return False
         except imaplib.IMAP4.error as o:
@@ -2061,11 +4010,55 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         except TimeoutError as o:
             self.log.info('TimeoutError after IDLE\n')
             return False
+        except socket.error as o:
+            self.log.info('connection lost during IDLE (%s)\n' % o)
+            return False
+        return True
 
-        if aborted:
-            raise aborted
+    def _idle_command(self):
+        tag = self.conn._command('IDLE')
+        # Untagged responses may come before the continuation response; they
+        # are kept for _gathernews(), and make idle_buffered() true, since
+        # the server will not send them again.
+        self._idlepending = False
+        while self.conn._get_response() is not None:
+            if self.conn.tagged_commands[tag]:
+                (typ, [data]) = self.conn.tagged_commands.pop(tag)
+                raise getmailOperationError(
+                    'IMAP4 IDLE requested, but server refused IDLE request: '
+                    '%s %s' % (typ, data)
+                )
+            self._idlepending = True
 
-        return True
+        self.log.debug('Entering IDLE mode (server says "%s")\n'
+                       % self.conn.continuation_response)
+        self._idletag = tag
+        self.idle_deadline = time.time() + self._idletimeout
+
+    def _notify(self, idle_mailbox):
+        '''Ask for STATUS responses about the other mailboxes during IDLE
+        (RFC 5465), so one connection covers all of them.
+        '''
+        self._notifying = True
+        others = [self.quote_mailbox(m).decode() for m in self.mailboxes
+                  if m != idle_mailbox]
+        if not others:
+            return
+        if 'NOTIFY' not in self.conn.capabilities:
+            self.log.debug('server does not support NOTIFY' + os.linesep)
+            return
+        imaplib.Commands.setdefault('NOTIFY', ('AUTH', 'SELECTED'))
+        try:
+            (typ, _) = self.conn._simple_command(
+                'NOTIFY', 'SET (SELECTED (MessageNew MessageExpunge))'
+                ' (MAILBOXES (%s) (MessageNew MessageExpunge))'
+                % ' '.join(others))
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as o:
+            typ = 'BAD %s' % o
+        if typ != 'OK':
+            self.log.warning('NOTIFY failed (%s)' % typ + os.linesep)
 
     def quit(self):
         self.log.trace()
@@ -2074,6 +4067,9 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         try:
             if self.mailbox_selected is not False:
                 self.close_mailbox()
+            self._endpool()
+            if isinstance(self.conn.file, IMAPDeflate):
+                self.log.info('  %s\n' % self.conn.file.summary())
             self.conn.logout()
         except imaplib.IMAP4.error as o:
             #raise getmailOperationError('IMAP error (%s)' % o)
@@ -2082,6 +4078,112 @@ class IMAPRetrieverBase(RetrieverSkeleton):
         self.conn = None
 
 
+#######################################
+class IMAPSessionPool(object):
+    '''Extra IMAP sessions of an account (max_connections), which select and
+    list the next mailboxes while getmail processes the current one.
+
+    Each worker thread logs in, takes the next mailbox not yet asked for, and
+    runs select_mailbox() for it on a copy of the retriever.  The retriever
+    takes the result over, with the session, in its own select_mailbox(), and
+    hands the session back in close_mailbox().
+    '''
+    def __init__(self, retriever, sessions):
+        self.retriever = retriever
+        self.log = retriever.log
+        self.todo = list(retriever.mailboxes)
+        self.busy = set()
+        self.ready = {}
+        self.closing = False
+        self.cond = threading.Condition()
+        self.released = queue.Queue()
+        self.threads = []
+        for unused in range(sessions):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        session = copy.copy(self.retriever)
+        session._pool = None
+        session.conn = None
+        try:
+            session._login()
+            if self.retriever.qresync:
+                session.enable_qresync()
+        except (getmailError, imaplib.IMAP4.error, socket.error) as o:
+            self.log.warning('extra IMAP session failed (%s)' % o + os.linesep)
+            return
+        conn = session.conn
+        while conn is not None:
+            with self.cond:
+                if self.closing or not self.todo:
+                    break
+                mailbox = self.todo.pop(0)
+                self.busy.add(mailbox)
+            session.conn = conn
+            session._clear_state()
+            (result, error) = (None, None)
+            try:
+                result = session.select_mailbox(mailbox)
+            except getmailOperationError as o:
+                error = o
+            except (imaplib.IMAP4.error, socket.error) as o:
+                # Session lost; the retriever selects the mailbox itself
+                self.log.debug('extra IMAP session failed (%s)' % o
+                               + os.linesep)
+                conn = None
+            with self.cond:
+                self.busy.discard(mailbox)
+                if conn is not None:
+                    self.ready[mailbox] = (dict(session.__dict__), result,
+                                           error)
+                self.cond.notify_all()
+            if conn is not None:
+                conn = self.released.get()
+        if conn is not None:
+            self._logout(conn)
+
+    def _logout(self, conn):
+        try:
+            conn.logout()
+        except (imaplib.IMAP4.error, socket.error) as o:
+            self.log.debug('IMAP error during logout (%s)' % o + os.linesep)
+
+    def take(self, mailbox):
+        '''Wait for mailbox to be selected by a worker.  Returns (state,
+        result, error) from the worker, or None if mailbox is left to the
+        caller.
+        '''
+        with self.cond:
+            if mailbox in self.todo:
+                self.todo.remove(mailbox)
+                return None
+            while mailbox in self.busy:
+                self.cond.wait()
+            return self.ready.pop(mailbox, None)
+
+    def release(self, conn):
+        '''Hand a session back for the next mailbox.'''
+        with self.cond:
+            if not self.closing:
+                self.released.put(conn)
+                return
+        self._logout(conn)
+
+    def close(self):
+        '''Stop the workers and log out of their sessions.'''
+        with self.cond:
+            self.closing = True
+        for unused in self.threads:
+            self.released.put(None)
+        for thread in self.threads:
+            thread.join()
+        for (state, unused, unused) in self.ready.values():
+            self._logout(state['conn'])
+        self.ready = {}
+
+
 #######################################
 class MultidropIMAPRetrieverBase(IMAPRetrieverBase):
     '''Base retriever class for multi-drop IMAP mailboxes.
@@ -53,6 +53,17 @@ class _Logger(object):
         '''
         self.handlers = []
 
+    def enabled(self, msglevel):
+        '''Return whether messages of level <msglevel> are output anywhere, so
+        that callers can skip building expensive ones.
+        '''
+        if not self.handlers:
+            return True
+        for handler in self.handlers:
+            if handler['minlevel'] <= msglevel <= handler['maxlevel']:
+                return True
+        return False
+
     def log(self, msglevel, msgtxt):
         '''Log a message of level <msglevel> containing text <msgtxt>.'''
         if isinstance(msgtxt,bytes):
@@ -37,6 +37,7 @@ message_attributes = (
 )
 
 _NL = os.linesep.encode()
+_BOM = b'\xef\xbb\xbf'
 
 #######################################
 def corrupt_message(why, fromlines=None, fromstring=None):
@@ -83,7 +84,8 @@ class Message(object):
         'recipient',
         'sender',
     )
-    def __init__(self, fromlines=None, fromstring=None, fromfile=None):
+    def __init__(self, fromlines=None, fromstring=None, fromfile=None,
+                 fromspool=None):
         #self.log = Logger()
         self.recipient = None
         self.received_by = None
@@ -92,7 +94,7 @@ class Message(object):
         self.__raw = None
         parser = Parser.BytesParser()
         def parsestr(raw_mail):
-            BOM = b'\xef\xbb\xbf'
+            BOM = _BOM
             # bad_pattern_lf = b'\n\n' + BOM
             # bad_pattern_crlf = b'\r\n\r\n' + BOM
             # if bad_pattern_lf in raw_mail:
@@ -106,7 +108,9 @@ class Message(object):
         # Message is instantiated with fromlines for POP3, fromstring for
         # IMAP (both of which can be badly-corrupted or invalid, i.e. spam,
         # MS worms, etc).  It's instantiated with fromfile for the output
-        # of filters, etc, which should be saner.
+        # of filters, etc, which should be saner.  fromspool is a seekable
+        # file holding a large IMAP message, parsed without reading it into
+        # memory at once; it is kept instead of a raw copy.
         if fromlines:
             try:
                 self.__msg = parsestr(_NL.join(fromlines))
@@ -133,6 +137,15 @@ class Message(object):
                 self.__msg = corrupt_message(o, fromstring=fromfile.read())
             # fromfile is only used by getmail_maildir, getmail_mbox, and
             # from reading the output of a filter.  Ignore __raw here.
+        elif fromspool:
+            try:
+                if fromspool.read(len(_BOM)) != _BOM:
+                    fromspool.seek(0)
+                self.__msg = parser.parse(fromspool)
+            except (Errors.MessageError,UnicodeDecodeError) as o:
+                fromspool.seek(0)
+                self.__msg = corrupt_message(o, fromstring=fromspool.read())
+            self.__raw = fromspool
         else:
             # Can't happen?
             raise SystemExit('Message() called with wrong arguments')
@@ -205,7 +218,12 @@ class Message(object):
                 # and returned a badly-misformatted one?
                 raise getmailDeliveryError('failed to parse retrieved message '
                                            'and could not recover (%s)' % o)
-            self.__msg = corrupt_message(o, fromstring=self.__raw)
+            raw = self.__raw
+            if not isinstance(raw, bytes):
+                # fromspool
+                raw.seek(0)
+                raw = raw.read()
+            self.__msg = corrupt_message(o, fromstring=raw)
             return self.flatten(delivered_to, received, mangle_from, include_from)
 
 
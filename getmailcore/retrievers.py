@@ -23,6 +23,7 @@ Currently implemented:
 '''
 
 import os
+import hashlib
 import poplib
 import imaplib
 import types
@@ -32,6 +33,8 @@ from getmailcore.constants import *
 from getmailcore.utilities import *
 from getmailcore.baseclasses import *
 from getmailcore._retrieverbases import *
+from getmailcore._retrieverbases import POP3MessageTable, pop3_iter_multiline
+from getmailcore._retrieverbases import pop3_read_multiline
 
 __all__ = [
     'BrokenUIDLPOP3Retriever',
@@ -61,6 +64,7 @@ class SimplePOP3Retriever(POP3RetrieverBase, POP3initMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=110),
         ConfString(name='username'),
@@ -68,6 +72,9 @@ class SimplePOP3Retriever(POP3RetrieverBase, POP3initMixIn):
         ConfTupleOfStrings(name='password_command', required=False, default=()),
         ConfBool(name='use_xoauth2', required=False, default=False),
         ConfBool(name='use_apop', required=False, default=False),
+        ConfInt(name='pop3_pipeline', required=False, default=0),
+        ConfInt(name='pop3_spool_threshold', required=False, default=0),
+        ConfBool(name='pop3_checkpoint', required=False, default=False),
         ConfBool(name='delete_dup_msgids', required=False, default=False),
     )
     received_from = None
@@ -96,6 +103,7 @@ class SimplePOP3SSLRetriever(POP3RetrieverBase, POP3SSLinitMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=POP3_SSL_PORT),
         ConfString(name='username'),
@@ -103,6 +111,9 @@ class SimplePOP3SSLRetriever(POP3RetrieverBase, POP3SSLinitMixIn):
         ConfTupleOfStrings(name='password_command', required=False, default=()),
         ConfBool(name='use_xoauth2', required=False, default=False),
         ConfBool(name='use_apop', required=False, default=False),
+        ConfInt(name='pop3_pipeline', required=False, default=0),
+        ConfInt(name='pop3_spool_threshold', required=False, default=0),
+        ConfBool(name='pop3_checkpoint', required=False, default=False),
         ConfBool(name='delete_dup_msgids', required=False, default=False),
         ConfFile(name='keyfile', required=False, default=None),
         ConfFile(name='certfile', required=False, default=None),
@@ -136,7 +147,12 @@ class BrokenUIDLPOP3RetrieverBase(POP3RetrieverBase):
     we cannot rely on UIDL, we have to use message numbers, which are unique
     within a POP3 session, but which change across sessions.  This class
     therefore can not be used to leave old mail on the server and download only
-    new mail.
+    new mail, unless digest_msgids is set.
+
+    With digest_msgids, a message is identified by its size and a digest of
+    its header (TOP n 0) instead, which does not change across sessions.
+    Messages that cannot be told apart that way keep their message numbers,
+    and are therefore always treated as new messages.
     '''
     received_from = None
     received_by = localhostname()
@@ -146,22 +162,75 @@ class BrokenUIDLPOP3RetrieverBase(POP3RetrieverBase):
         duplicated IDs are always treated as new messages.'''
         self.log.trace()
 
-    def write_oldmailfile(self, _, **kwargs):
-        '''Short-circuit writing the oldmail file.'''
+    def write_oldmailfile(self, mailbox, **kwargs):
+        '''Short-circuit writing the oldmail file, unless digest_msgids is
+        set.'''
         self.log.trace()
+        if self.conf.get('digest_msgids', False):
+            POP3RetrieverBase.write_oldmailfile(self, mailbox)
+
+    def delivered(self, msgid):
+        # Message numbers change across sessions, don't remember them
+        if not isinstance(msgid, int):
+            POP3RetrieverBase.delivered(self, msgid)
+
+    def initialize(self, options):
+        # Message numbers only stay the same within a session
+        self._digests = {}
+        POP3RetrieverBase.initialize(self, options)
+
+    def _digestmsgids(self, table):
+        '''Return the IDs made of size and header digest of the messages
+        in table, by message number.  Messages whose IDs collide get none.
+        '''
+        todo = [msgnum for (msgnum, size) in zip(table.msgnums, table.sizes)
+                if self._digests.get(msgnum, (None, ))[0] != size]
+        # With PIPELINING, send up to pop3_pipeline TOP commands at once
+        step = self._pipelining and self.conf['pop3_pipeline'] or 1
+        for i in range(0, len(todo), step):
+            msgnums = todo[i:i + step]
+            self.conn.sock.sendall(b''.join(
+                b'TOP %d 0\r\n' % msgnum for msgnum in msgnums))
+            for msgnum in msgnums:
+                self.conn._getresp()
+                (header, _) = pop3_read_multiline(self.conn)
+                size = table.sizes[table.find(msgnum)]
+                self._digests[msgnum] = (size, '%d.%s' % (
+                    size, hashlib.sha256(header).hexdigest()))
+        msgnums_by_msgid = {}
+        for msgnum in table.msgnums:
+            msgnums_by_msgid.setdefault(
+                self._digests[msgnum][1], []).append(msgnum)
+        msgid_by_msgnum = {}
+        for (msgid, msgnums) in msgnums_by_msgid.items():
+            if len(msgnums) > 1:
+                self.log.debug('messages %s have the same size and header, '
+                               'always retrieving them' % msgnums + os.linesep)
+                continue
+            msgid_by_msgnum[msgnums[0]] = msgid
+        return msgid_by_msgnum
 
     def _getmsglist(self):
-        '''Don't rely on UIDL; instead, use just the message number.'''
+        '''Don't rely on UIDL; instead, use just the message number, or
+        size and header digest.'''
         self.log.trace()
         try:
-            (_, msglist, _) = self.conn.list()
-            for line in msglist:
-                msgnum = int(line.split()[0])
-                msgsize = int(line.split()[1])
-                self.msgnum_by_msgid[msgnum] = msgnum
-                self.msgid_by_msgnum[msgnum] = msgnum
-                self.msgsizes[msgnum] = msgsize
-            self.sorted_msgnum_msgid = sorted(self.msgid_by_msgnum.items())
+            self.conn._putcmd('LIST')
+            self.conn._getresp()
+            table = POP3MessageTable()
+            for line in pop3_iter_multiline(self.conn):
+                (msgnum, msgsize) = line.split()[:2]
+                table.add(int(msgnum), int(msgnum), int(msgsize))
+            table.sort()
+            if self.conf.get('digest_msgids', False):
+                msgid_by_msgnum = self._digestmsgids(table)
+                digested = POP3MessageTable()
+                for (msgnum, size) in zip(table.msgnums, table.sizes):
+                    digested.add(msgnum, msgid_by_msgnum.get(msgnum, msgnum),
+                                 size)
+                table = digested
+            self._usemsgtable(table)
+            self._prunevanished()
         except poplib.error_proto as o:
             raise getmailOperationError('POP error (%s)' % o)
         self.gotmsglist = True
@@ -175,6 +244,7 @@ class BrokenUIDLPOP3Retriever(BrokenUIDLPOP3RetrieverBase, POP3initMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=110),
         ConfString(name='username'),
@@ -182,6 +252,9 @@ class BrokenUIDLPOP3Retriever(BrokenUIDLPOP3RetrieverBase, POP3initMixIn):
         ConfTupleOfStrings(name='password_command', required=False, default=()),
         ConfBool(name='use_xoauth2', required=False, default=False),
         ConfBool(name='use_apop', required=False, default=False),
+        ConfInt(name='pop3_pipeline', required=False, default=0),
+        ConfInt(name='pop3_spool_threshold', required=False, default=0),
+        ConfBool(name='digest_msgids', required=False, default=False),
     )
     received_with = 'POP3'
 
@@ -207,6 +280,7 @@ class BrokenUIDLPOP3SSLRetriever(BrokenUIDLPOP3RetrieverBase, POP3SSLinitMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=POP3_SSL_PORT),
         ConfString(name='username'),
@@ -214,6 +288,9 @@ class BrokenUIDLPOP3SSLRetriever(BrokenUIDLPOP3RetrieverBase, POP3SSLinitMixIn):
         ConfTupleOfStrings(name='password_command', required=False, default=()),
         ConfBool(name='use_xoauth2', required=False, default=False),
         ConfBool(name='use_apop', required=False, default=False),
+        ConfInt(name='pop3_pipeline', required=False, default=0),
+        ConfInt(name='pop3_spool_threshold', required=False, default=0),
+        ConfBool(name='digest_msgids', required=False, default=False),
         ConfFile(name='keyfile', required=False, default=None),
         ConfFile(name='certfile', required=False, default=None),
         ConfFile(name='ca_certs', required=False, default=None),
@@ -246,6 +323,7 @@ class MultidropPOP3Retriever(MultidropPOP3RetrieverBase, POP3initMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=110),
         ConfString(name='username'),
@@ -253,6 +331,9 @@ class MultidropPOP3Retriever(MultidropPOP3RetrieverBase, POP3initMixIn):
         ConfTupleOfStrings(name='password_command', required=False, default=()),
         ConfBool(name='use_xoauth2', required=False, default=False),
         ConfBool(name='use_apop', required=False, default=False),
+        ConfInt(name='pop3_pipeline', required=False, default=0),
+        ConfInt(name='pop3_spool_threshold', required=False, default=0),
+        ConfBool(name='pop3_checkpoint', required=False, default=False),
         ConfString(name='envelope_recipient'),
     )
     received_from = None
@@ -281,6 +362,7 @@ class MultidropPOP3SSLRetriever(MultidropPOP3RetrieverBase, POP3SSLinitMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=POP3_SSL_PORT),
         ConfString(name='username'),
@@ -288,6 +370,9 @@ class MultidropPOP3SSLRetriever(MultidropPOP3RetrieverBase, POP3SSLinitMixIn):
         ConfTupleOfStrings(name='password_command', required=False, default=()),
         ConfBool(name='use_xoauth2', required=False, default=False),
         ConfBool(name='use_apop', required=False, default=False),
+        ConfInt(name='pop3_pipeline', required=False, default=0),
+        ConfInt(name='pop3_spool_threshold', required=False, default=0),
+        ConfBool(name='pop3_checkpoint', required=False, default=False),
         ConfString(name='envelope_recipient'),
         ConfFile(name='keyfile', required=False, default=None),
         ConfFile(name='certfile', required=False, default=None),
@@ -330,6 +415,7 @@ class MultidropSDPSRetriever(SimplePOP3Retriever, POP3initMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=110),
         ConfString(name='username'),
@@ -384,6 +470,7 @@ class SimpleIMAPRetriever(IMAPRetrieverBase, IMAPinitMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=imaplib.IMAP4_PORT),
         ConfString(name='username'),
@@ -403,6 +490,18 @@ class SimpleIMAPRetriever(IMAPRetrieverBase, IMAPinitMixIn):
         ConfString(name='imap_search', required=False, default=None),
         ConfString(name='imap_on_delete', required=False, default=None),
         ConfBool(name='imap_id_extension', required=False, default=False),
+        ConfInt(name='imap_fetch_batch', required=False, default=1),
+        ConfInt(name='imap_fetch_batch_bytes', required=False, default=8388608),
+        ConfBool(name='imap_qresync', required=False, default=False),
+        ConfBool(name='imap_skip_unchanged', required=False, default=False),
+        ConfInt(name='imap_list_cache_ttl', required=False, default=0),
+        ConfInt(name='imap_idle_renew', required=False, default=240),
+        ConfBool(name='imap_notify', required=False, default=False),
+        ConfInt(name='max_connections', required=False, default=1),
+        ConfBool(name='imap_compress', required=False, default=False),
+        ConfInt(name='imap_spool_threshold', required=False, default=0),
+        ConfBool(name='imap_search_policies', required=False, default=False),
+        ConfInt(name='imap_capability_cache_ttl', required=False, default=0),
     )
     received_from = None
     received_with = 'IMAP4'
@@ -430,6 +529,7 @@ class SimpleIMAPSSLRetriever(IMAPRetrieverBase, IMAPSSLinitMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=imaplib.IMAP4_SSL_PORT),
         ConfString(name='username'),
@@ -456,6 +556,18 @@ class SimpleIMAPSSLRetriever(IMAPRetrieverBase, IMAPSSLinitMixIn):
         ConfString(name='imap_search', required=False, default=None),
         ConfString(name='imap_on_delete', required=False, default=None),
         ConfBool(name='imap_id_extension', required=False, default=False),
+        ConfInt(name='imap_fetch_batch', required=False, default=1),
+        ConfInt(name='imap_fetch_batch_bytes', required=False, default=8388608),
+        ConfBool(name='imap_qresync', required=False, default=False),
+        ConfBool(name='imap_skip_unchanged', required=False, default=False),
+        ConfInt(name='imap_list_cache_ttl', required=False, default=0),
+        ConfInt(name='imap_idle_renew', required=False, default=240),
+        ConfBool(name='imap_notify', required=False, default=False),
+        ConfInt(name='max_connections', required=False, default=1),
+        ConfBool(name='imap_compress', required=False, default=False),
+        ConfInt(name='imap_spool_threshold', required=False, default=0),
+        ConfBool(name='imap_search_policies', required=False, default=False),
+        ConfInt(name='imap_capability_cache_ttl', required=False, default=0),
     )
     received_from = None
     received_with = 'IMAP4-SSL'
@@ -483,6 +595,7 @@ class MultidropIMAPRetriever(MultidropIMAPRetrieverBase, IMAPinitMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=imaplib.IMAP4_PORT),
         ConfString(name='username'),
@@ -503,6 +616,18 @@ class MultidropIMAPRetriever(MultidropIMAPRetrieverBase, IMAPinitMixIn):
         ConfString(name='imap_search', required=False, default=None),
         ConfString(name='imap_on_delete', required=False, default=None),
         ConfBool(name='imap_id_extension', required=False, default=False),
+        ConfInt(name='imap_fetch_batch', required=False, default=1),
+        ConfInt(name='imap_fetch_batch_bytes', required=False, default=8388608),
+        ConfBool(name='imap_qresync', required=False, default=False),
+        ConfBool(name='imap_skip_unchanged', required=False, default=False),
+        ConfInt(name='imap_list_cache_ttl', required=False, default=0),
+        ConfInt(name='imap_idle_renew', required=False, default=240),
+        ConfBool(name='imap_notify', required=False, default=False),
+        ConfInt(name='max_connections', required=False, default=1),
+        ConfBool(name='imap_compress', required=False, default=False),
+        ConfInt(name='imap_spool_threshold', required=False, default=0),
+        ConfBool(name='imap_search_policies', required=False, default=False),
+        ConfInt(name='imap_capability_cache_ttl', required=False, default=0),
     )
     received_from = None
     received_with = 'IMAP4'
@@ -530,6 +655,7 @@ class MultidropIMAPSSLRetriever(MultidropIMAPRetrieverBase, IMAPSSLinitMixIn):
         ConfDirectory(name='getmaildir', required=False, default='~/.getmail/'),
 
         ConfInt(name='timeout', required=False, default=180),
+        ConfString(name='address_preference', required=False, default=None),
         ConfString(name='server'),
         ConfInt(name='port', required=False, default=imaplib.IMAP4_SSL_PORT),
         ConfString(name='username'),
@@ -557,6 +683,18 @@ class MultidropIMAPSSLRetriever(MultidropIMAPRetrieverBase, IMAPSSLinitMixIn):
         ConfString(name='imap_search', required=False, default=None),
         ConfString(name='imap_on_delete', required=False, default=None),
         ConfBool(name='imap_id_extension', required=False, default=False),
+        ConfInt(name='imap_fetch_batch', required=False, default=1),
+        ConfInt(name='imap_fetch_batch_bytes', required=False, default=8388608),
+        ConfBool(name='imap_qresync', required=False, default=False),
+        ConfBool(name='imap_skip_unchanged', required=False, default=False),
+        ConfInt(name='imap_list_cache_ttl', required=False, default=0),
+        ConfInt(name='imap_idle_renew', required=False, default=240),
+        ConfBool(name='imap_notify', required=False, default=False),
+        ConfInt(name='max_connections', required=False, default=1),
+        ConfBool(name='imap_compress', required=False, default=False),
+        ConfInt(name='imap_spool_threshold', required=False, default=0),
+        ConfBool(name='imap_search_policies', required=False, default=False),
+        ConfInt(name='imap_capability_cache_ttl', required=False, default=0),
     )
     received_from = None
     received_with = 'IMAP4-SSL'
@@ -31,6 +31,7 @@ except ImportError: #Py 2.7
 
 __all__ = [
     'address_no_brackets',
+    'check_address_preference',
     'change_uidgid',
     'change_usergroup',
     'check_ca_certs',
@@ -529,6 +530,21 @@ def check_ca_certs(conf):
         )
     return ca_certs
 
+#######################################
+def check_address_preference(conf):
+    address_preference = conf.get('address_preference', None)
+    if address_preference is None:
+        return socket.AF_UNSPEC
+    family = {
+        'ipv4': socket.AF_INET,
+        'ipv6': socket.AF_INET6,
+    }.get(address_preference.lower())
+    if family is None:
+        raise getmailConfigurationError(
+            'unknown address_preference "%s"' % address_preference
+        )
+    return family
+
 #######################################
 def check_ssl_version(conf):
     ssl_version = conf['ssl_version']
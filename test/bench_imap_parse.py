@@ -0,0 +1,40 @@
+'''Micro-benchmark for the IMAP FETCH response parser.
+
+Run from the repository root:
+
+    python test/bench_imap_parse.py [number of messages]
+
+Prints lines per second for a UID RFC822.SIZE listing of that many messages
+(default 500000) and for FETCH lines with Gmail metadata.
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from getmailcore._retrieverbases import (
+    imap_parse_fetch, imap_parse_gmailmetadata,
+)
+
+def bench(name, func, lines):
+    start = time.perf_counter()
+    for line in lines:
+        func(line)
+    elapsed = time.perf_counter() - start
+    print('%-10s %8d lines %7.3fs %10.0f lines/s'
+          % (name, len(lines), elapsed, len(lines) / elapsed))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    bench('listing', imap_parse_fetch,
+          [b'%d (UID %d RFC822.SIZE %d)' % (i, i + 1000, 2000 + i % 50000)
+           for i in range(1, count + 1)])
+    bench('gmail', imap_parse_gmailmetadata,
+          [b'%d (X-GM-THRID %d X-GM-MSGID %d X-GM-LABELS (\\Inbox "a b") '
+           b'UID %d BODY[] {%d}' % (i, i, i, i, 2000 + i % 50000)
+           for i in range(1, count // 10 + 1)])
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,19 @@
 import sys
 import textwrap
 import subprocess
+import tempfile
 import unittest.mock as mock
 
 from getmailcore.message import Message
 from getmailcore.exceptions import *
 from getmailcore.destinations import MDA_lmtp
+from getmailcore._retrieverbases import imap_parse_fetch, imap_parse_gmailmetadata
+from getmailcore._retrieverbases import pop3_read_multiline
+from getmailcore._retrieverbases import pop3_iter_multiline, POP3MessageTable
+from getmailcore import _retrieverbases
 import getmailcore.logging as getmail_logging
 
-import os, smtplib, ssl
+import io, os, poplib, smtplib, ssl, socket
 import pytest
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -89,6 +94,61 @@ def test_add_header2():
     assert gmm.content()['X-greetde'] != greetde
     #mm.as_string()
 
+def test_message_fromspool():
+    m = EmailMessage()
+    m["Subject"] = "spooled"
+    m["From"] = "my@gmail.com"
+    m.set_content(greetde)
+    spool = tempfile.TemporaryFile()
+    spool.write(b'\xef\xbb\xbf' + m.as_bytes())
+    spool.seek(0)
+    gm = Message(fromspool=spool)
+    assert gm.content()["Subject"] == "spooled"
+    assert gm.flatten(False, False) == Message(fromstring=m.as_bytes()).flatten(False, False)
+
+def test_pop3_read_multiline():
+    body = b"Subject: dots\r\n\r\n..\r\n...x\r\n" + b"a" * 100000 + b"\r\n"
+    for (threshold, spooled) in ((0, False), (1000, True)):
+        conn = mock.Mock(file=io.BufferedReader(
+            io.BytesIO(body + b".\r\n+OK next\r\n"), 4096))
+        (data, octets) = pop3_read_multiline(conn, threshold)
+        if spooled:
+            data = data.read()
+        assert data == b"Subject: dots\n\n.\n..x\n" + b"a" * 100000 + b"\n"
+        assert octets == len(body)
+        # a pipelined reply after it is left alone
+        assert conn.file.read() == b"+OK next\r\n"
+    conn = mock.Mock(file=io.BufferedReader(io.BytesIO(b".\r\n")))
+    assert pop3_read_multiline(conn) == (b"", 0)
+    # the terminator read across a cut of what is spooled
+    body = b"a" * 65533 + b"\r\n"
+    conn = mock.Mock(file=io.BufferedReader(
+        io.BytesIO(body + b".\r\n+OK next\r\n"), 8192))
+    (data, octets) = pop3_read_multiline(conn, 1000)
+    assert data.read() == b"a" * 65533 + b"\n"
+    assert octets == len(body)
+    assert conn.file.read() == b"+OK next\r\n"
+
+def test_pop3_message_table():
+    conn = poplib.POP3.__new__(poplib.POP3)
+    conn._debugging = 0
+    conn.file = io.BufferedReader(io.BytesIO(
+        b"3 c\r\n1 a\r\n2 b\r\n.\r\n1 10\r\n3 30\r\n.\r\n"))
+    table = POP3MessageTable()
+    for line in pop3_iter_multiline(conn):
+        (msgnum, msgid) = line.decode().split()
+        assert table.add(int(msgnum), msgid)
+    assert not table.add(4, "b")
+    table.sort()
+    for line in pop3_iter_multiline(conn):
+        table.setsize(*[int(x) for x in line.split()])
+    assert list(table.sorted_msgnum_msgid) == [(1, "a"), (2, "b"), (3, "c")]
+    assert dict(table.msgnum_by_msgid) == {"a": 1, "b": 2, "c": 3}
+    assert table.msgid_by_msgnum[3] == "c"
+    assert 4 not in table.msgid_by_msgnum
+    assert dict(table.msgsizes) == {"a": 10, "c": 30}
+    assert "b" not in table.msgsizes
+
 def test_spam_1():
     fl = os.path.join(os.path.split(__file__)[0],'spam.eml')
     with open(fl,'br') as f:
@@ -105,6 +165,41 @@ def test_spam_2():
     except getmailDeliveryError as o:
         assert 'could not recover' in str(o) # noqa: PT017
 
+def test_imap_parse_fetch():
+    assert imap_parse_fetch(b'1 (UID 5 RFC822.SIZE 100)') == {
+        'uid': '5', 'rfc822.size': '100'}
+    assert imap_parse_fetch(b'7 (FLAGS (\\Seen NonJunk) UID 9)') == {
+        'flags': [b'\\Seen', b'NonJunk'], 'uid': '9'}
+    # metadata before and after the literal, labels quoted and nested
+    line = (b'1 (X-GM-LABELS (\\Inbox "a \\"b\\"") UID 3 BODY[] {12}'
+            b' X-GM-THRID 7 X-GM-MSGID 8)')
+    assert imap_parse_fetch(line)['x-gm-labels'] == [b'\\Inbox', b'a "b"']
+    assert imap_parse_gmailmetadata(line) == {
+        'X-GMAIL-LABELS': b'\\Inbox "a \\"b\\""',
+        'X-GMAIL-THRID': b'7', 'X-GMAIL-MSGID': b'8'}
+    with pytest.raises(ValueError, match='odd number'):
+        imap_parse_fetch(b'1 (UID)')
+
+def test_connect_racing():
+    v4 = (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', 1))
+    v6 = (socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('::1', 1, 0, 0))
+    assert _retrieverbases.interleave_addrinfos(
+        [v6, v6, v4], socket.AF_INET) == [v4, v6, v6]
+    with socket.create_server(('127.0.0.1', 0)) as server:
+        good = v4[:4] + (server.getsockname(), )
+        # from the DNS cache: a refused address first, then the server's
+        key = ('mail.example.invalid', 143, socket.AF_UNSPEC)
+        _retrieverbases.DNS_CACHE[key] = (float('inf'), [v4, good])
+        timings = {}
+        try:
+            with _retrieverbases.connect_racing(
+                    'mail.example.invalid', 143, 5, timings=timings) as sock:
+                assert sock.getpeername() == server.getsockname()
+                assert sock.gettimeout() == 5
+        finally:
+            del _retrieverbases.DNS_CACHE[key]
+        assert sorted(timings) == ['dns', 'tcp']
+
 def test_imap_ssl_parameters(capfd):
     for d in ("cur", "new", "tmp"):
         os.makedirs(f"/tmp/ssl/Maildir/{d}",exist_ok=True)
@@ -140,6 +235,16 @@ def test_imap_ssl_parameters(capfd):
         assert c.err.index("AUTHENTICATIONFAILED") > 0
 
 
+def test_go_jobs_exitcode():
+    spec = spec_from_loader("getmail", SourceFileLoader("getmail", "getmail"))
+    getmail = module_from_spec(spec)
+    spec.loader.exec_module(getmail)
+    # what main() would exit the worker with, e.g. 3 for an operation error
+    exitcodes = {"ok": 0, "error": 3}
+    getmail.go = lambda configs, *args: os._exit(exitcodes[configs[0]])
+    assert getmail.go_jobs(["ok", "error"], 2) == 3
+    assert getmail.go_jobs(["ok", "ok"], 2) == 0
+
 @pytest.fixture(autouse=False)
 def clean_logger():
     """Clear stale Logger handlers that may have been set up by other tests."""
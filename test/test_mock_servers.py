@@ -5,9 +5,12 @@ import sys
 import tempfile
 import textwrap
 import glob
+import hashlib
 import socket
 import os
 import re
+import time
+import zlib
 from typing import NamedTuple
 import pytest
 import email.message
@@ -73,6 +76,13 @@ def imap_reply_fetch_body(tag, index, uid, size=3, body="a"):
     )
 
 
+def imap_reply_fetch_bodies(tag, uids, body="a"):
+    return "".join(
+        f"* {uid} FETCH (UID {uid} BODY[] {{{len(body) + 2}}}\r\n{body}\r\n)\r\n"
+        for uid in uids
+    ) + f"{tag} OK Fetch completed\r\n"
+
+
 def imap_reply_logout(tag):
     return textwrap.dedent(
         f"""\
@@ -248,6 +258,239 @@ def test_pop3_broken_uidl(destination_type, destination_init):
         p.join()
 
 
+def test_pop3_broken_uidl_digest():
+    mock_tcp = MockTCP()
+    header = "Subject: a\n\n"
+    msgid = "1." + hashlib.sha256(header.encode()).hexdigest()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        port = mock_tcp.server.getsockname()[1]
+        oldmail = f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name"
+        with open(oldmail, "w") as f:
+            f.write(f"{msgid}\x001745765433\n")
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    max_message_size = 1
+
+                    [retriever]
+                    type = BrokenUIDLPOP3Retriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    digest_msgids = true
+
+                    [destination]
+                    type = MDA_external
+                    {mda_external_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("+OK:\n")
+        mock_tcp.expect("USER account_name")
+        mock_tcp.send("+OK:\n")
+        mock_tcp.expect("PASS my_mail_password")
+        mock_tcp.send("+OK:\n")
+        mock_tcp.expect("LIST")
+        mock_tcp.send(pop3_list((1, 2, 2)))
+        # 2 and 3 collide
+        for n in (1, 2, 3):
+            mock_tcp.expect(f"TOP {n} 0")
+            mock_tcp.send("+OK\r\n" + header.replace("\n", "\r\n") + ".\r\n")
+        # header digests are only asked for once per session
+        mock_tcp.expect("LIST")
+        mock_tcp.send(pop3_list((1, 2, 2)))
+        # 1 was seen before, 2 and 3 are too large, nothing is retrieved
+        mock_tcp.expect("QUIT")
+        mock_tcp.send("+OK:")
+        mock_tcp.close()
+        p.join()
+        assert p.exitcode == 0
+        with open(oldmail) as f:
+            assert f.read() == f"{msgid}\x001745765433\n"
+
+
+def test_pop3_pipeline():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        port = mock_tcp.server.getsockname()[1]
+        with open(f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name", "w") as f:
+            f.write("a\x001745765433\nb\x001745765433\n")
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    delete_after = 1
+
+                    [retriever]
+                    type = SimplePOP3Retriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    pop3_pipeline = 5
+
+                    [destination]
+                    type = MDA_external
+                    {mda_external_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("+OK:\n")
+        mock_tcp.expect("USER account_name")
+        mock_tcp.send("+OK:\n")
+        mock_tcp.expect("PASS my_mail_password")
+        mock_tcp.send("+OK:\n")
+        mock_tcp.expect("CAPA")
+        mock_tcp.send("+OK\r\nUIDL\r\nPIPELINING\r\n.\r\n")
+        uidls = ("a", "b", "c", "d")
+        for unused in range(2):
+            mock_tcp.expect("UIDL")
+            mock_tcp.send(pop3_uidl(uidls))
+            mock_tcp.expect("LIST")
+            mock_tcp.send(pop3_list((1, 1, 1, 1)))
+        # Old messages deleted, new ones retrieved, without waiting for replies
+        buf = ""
+        while "RETR 4" not in buf:
+            buf += mock_tcp.socket.recv(1024).decode()
+        assert buf == "DELE 1\r\nDELE 2\r\nRETR 3\r\nRETR 4\r\n"
+        mock_tcp.send("+OK\r\n+OK\r\n" + pop3_retr(generate_email())
+                      + "-ERR no such message\r\n")
+        mock_tcp.expect("QUIT")
+        mock_tcp.send("+OK:")
+        mock_tcp.close()
+        p.join()
+    # for the failed RETR 4
+    assert p.exitcode != 0
+
+
+def test_pop3_spool_cut():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [retriever]
+                    type = SimplePOP3Retriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    pop3_spool_threshold = 1000
+
+                    [destination]
+                    type = MDA_external
+                    path = /bin/sh
+                    arguments = ("-c", "cat > {tmpdir}/message")
+                    allow_root_commands = true
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("+OK:\n")
+        mock_tcp.expect("USER account_name")
+        mock_tcp.send("+OK:\n")
+        mock_tcp.expect("PASS my_mail_password")
+        mock_tcp.send("+OK:\n")
+        # 65536 octets, as much as is read before spooling, up to the "."
+        head = "Subject: spooled\r\n\r\n"
+        body = head + "a" * (65536 - len(head) - 3) + "\r\n"
+        for unused in range(2):
+            mock_tcp.expect("UIDL")
+            mock_tcp.send(pop3_uidl(("a",)))
+            mock_tcp.expect("LIST")
+            mock_tcp.send(pop3_list((len(body),)))
+        mock_tcp.expect("RETR 1")
+        mock_tcp.send(f"+OK {len(body)} octets\r\n" + body + ".")
+        # the rest of the terminator after the data before it was spooled
+        time.sleep(0.5)
+        mock_tcp.send("\r\n")
+        mock_tcp.expect("QUIT")
+        mock_tcp.send("+OK:")
+        mock_tcp.close()
+        p.join()
+        assert p.exitcode == 0
+        with open(f"{tmpdir}/message") as f:
+            assert f.read().endswith("\n\n" + "a" * (65536 - len(head) - 3)
+                                     + "\n")
+
+def test_pop3_checkpoint():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        port = mock_tcp.server.getsockname()[1]
+        oldmail = f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name"
+        with open(oldmail, "w") as f:
+            f.write("a\x001745765433\nb\x001745765433\n")
+        with open(oldmail + ".checkpoint", "w") as f:
+            f.write("2\n2\nb\n")
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    max_message_size = 1
+
+                    [retriever]
+                    type = SimplePOP3Retriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    pop3_checkpoint = true
+
+                    [destination]
+                    type = MDA_external
+                    {mda_external_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("+OK:\n")
+        mock_tcp.expect("USER account_name")
+        mock_tcp.send("+OK:\n")
+        mock_tcp.expect("PASS my_mail_password")
+        mock_tcp.send("+OK:\n")
+        # Only the message appended since the last run is listed
+        for unused in range(2):
+            mock_tcp.expect("STAT")
+            mock_tcp.send("+OK 3 4\r\n")
+            mock_tcp.expect("UIDL 2")
+            mock_tcp.send("+OK 2 b\r\n")
+            mock_tcp.expect("UIDL 3")
+            mock_tcp.send("+OK 3 c\r\n")
+            mock_tcp.expect("LIST 3")
+            mock_tcp.send("+OK 3 2\r\n")
+        # c is too large to retrieve, which leaves nothing behind
+        mock_tcp.expect("QUIT")
+        mock_tcp.send("+OK:")
+        mock_tcp.close()
+        p.join()
+        assert p.exitcode == 0
+        with open(oldmail + ".checkpoint") as f:
+            assert f.read() == "3\n4\nc\n"
+
+
 def multidest_init(tmpdir):
     destination_paths = (f"{tmpdir}/Maildir1/", f"{tmpdir}/Maildir2/")
 
@@ -440,11 +683,10 @@ def test_imap_full():
         mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), (FetchSize(2, 3)))))
         tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1 \(BODY.PEEK\[]\)").group(1)
         mock_tcp.send(imap_reply_fetch_body(tag, 1, 1))
-        tag = mock_tcp.expect(r"([^ ]*) UID STORE 1 FLAGS \(\\Deleted \\Seen\)").group(1)
-        mock_tcp.send(f"{tag} OK completed\r\n")
         tag = mock_tcp.expect(r"([^ ]*) UID FETCH 2 \(BODY.PEEK\[]\)").group(1)
         mock_tcp.send(imap_reply_fetch_body(tag, 2, 2))
-        tag = mock_tcp.expect(r"([^ ]*) UID STORE 2 FLAGS \(\\Deleted \\Seen\)").group(1)
+        # deletions are flagged together when leaving the mailbox
+        tag = mock_tcp.expect(r"([^ ]*) UID STORE 1:2 FLAGS \(\\Deleted \\Seen\)").group(1)
         mock_tcp.send(f"{tag} OK completed\r\n")
         tag = mock_tcp.expect(r"([^ ]*) EXPUNGE").group(1)
         mock_tcp.send(f"{tag} OK completed\r\n")
@@ -454,3 +696,1374 @@ def test_imap_full():
         mock_tcp.send(imap_reply_logout(tag))
         mock_tcp.close()
         p.join()
+
+
+def test_imap_search():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    imap_search = UNSEEN
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+        mock_tcp.send(imap_reply_examine_inbox(tag, exists=4, uidvalidity=1))
+        tag = mock_tcp.expect("([^ ]*) UID SEARCH UNSEEN").group(1)
+        mock_tcp.send(f"* SEARCH 4 1 3\r\n{tag} OK Search completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1,3:4 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), FetchSize(3, 3), FetchSize(4, 3))))
+        for uid in (1, 3, 4):
+            tag = mock_tcp.expect(rf"([^ ]*) UID FETCH {uid} \(BODY.PEEK\[]\)").group(1)
+            mock_tcp.send(imap_reply_fetch_body(tag, uid, uid))
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.close()
+        p.join()
+
+
+def test_imap_qresync():
+    mock_tcp = MockTCP()
+    port = mock_tcp.server.getsockname()[1]
+    capability = "* CAPABILITY IMAP4rev1 ENABLE CONDSTORE QRESYNC\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        oldmail = f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name-INBOX"
+        with open(oldmail, "w") as f:
+            f.write("1/4\x001600000000\n1/5\x001600000000\n")
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    max_message_size = 10
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    imap_qresync = true
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        for select, modseq in (
+            ("EXAMINE INBOX", 100),
+            (r"EXAMINE INBOX \(QRESYNC \(1 100\)\)", 120),
+        ):
+            sys.argv = ["getmail", "--getmaildir", tmpdir]
+            p = multiprocessing.Process(target=get_getmail, args=())
+            p.start()
+            mock_tcp.accept()
+            mock_tcp.send("* OK\r\n")
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(capability.format(tag))
+            tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+            mock_tcp.send(imap_reply_login(tag))
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(capability.format(tag))
+            tag = mock_tcp.expect("([^ ]*) ENABLE QRESYNC").group(1)
+            mock_tcp.send(f"* ENABLED QRESYNC\r\n{tag} OK Enabled\r\n")
+            tag = mock_tcp.expect(f"([^ ]*) {select}").group(1)
+            mock_tcp.send(
+                f"* 3 EXISTS\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n"
+                f"* OK [HIGHESTMODSEQ {modseq}] Highest\r\n"
+                + ("* VANISHED (EARLIER) 5:9\r\n" if modseq == 120 else "")
+                + f"{tag} OK [READ-ONLY]\r\n"
+            )
+            if modseq == 100:
+                tag = mock_tcp.expect(r"([^ ]*) FETCH 1:3 \(UID RFC822.SIZE\)").group(1)
+                mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 30), FetchSize(2, 30), FetchSize(4, 3))))
+            else:
+                # not retrieved last time, as too big
+                tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1:2 \(UID RFC822.SIZE\)").group(1)
+                mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 30), FetchSize(2, 30))))
+                tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1:\* \(UID RFC822.SIZE\) \(CHANGEDSINCE 100\)").group(1)
+                mock_tcp.send(f"* 3 FETCH (UID 4 RFC822.SIZE 3 MODSEQ (110))\r\n{tag} OK Fetch completed\r\n")
+            tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+            mock_tcp.send(imap_close(tag))
+            tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+            mock_tcp.send(imap_reply_logout(tag))
+            mock_tcp.close()
+            p.join()
+        with open(oldmail) as f:
+            assert "1/5\x00" not in f.read()
+        with open(f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name.state") as f:
+            assert "highestmodseq=120" in f.read()
+
+
+def test_imap_skip_unchanged():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    imap_skip_unchanged = true
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        for unchanged in (False, True):
+            sys.argv = ["getmail", "--getmaildir", tmpdir]
+            p = multiprocessing.Process(target=get_getmail, args=())
+            p.start()
+            mock_tcp.accept()
+            mock_tcp.send("* OK\r\n")
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(imap_reply_capability(tag))
+            tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+            mock_tcp.send(imap_reply_login(tag))
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(imap_reply_capability(tag))
+            if unchanged:
+                tag = mock_tcp.expect(r"([^ ]*) STATUS INBOX \(MESSAGES UIDNEXT UIDVALIDITY\)").group(1)
+                mock_tcp.send(f"* STATUS INBOX (MESSAGES 0 UIDNEXT 5 UIDVALIDITY 1)\r\n{tag} OK Status\r\n")
+            else:
+                tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+                mock_tcp.send(f"* 0 EXISTS\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n"
+                              f"* OK [UIDNEXT 5] Predicted next UID\r\n{tag} OK [READ-ONLY]\r\n")
+                tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+                mock_tcp.send(imap_close(tag))
+            tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+            mock_tcp.send(imap_reply_logout(tag))
+            mock_tcp.close()
+            p.join()
+
+
+def test_imap_list_status():
+    mock_tcp = MockTCP()
+    port = mock_tcp.server.getsockname()[1]
+    capability = "* CAPABILITY IMAP4rev1 LIST-STATUS\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name.state", "w") as f:
+            f.write("INBOX\x00messages=0\x00uidnext=5\x00uidvalidity=1\x00unretrieved=0\n")
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    mailboxes = ALL
+                    imap_skip_unchanged = true
+                    imap_list_cache_ttl = 3600
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        for cached in (False, True):
+            sys.argv = ["getmail", "--getmaildir", tmpdir]
+            p = multiprocessing.Process(target=get_getmail, args=())
+            p.start()
+            mock_tcp.accept()
+            mock_tcp.send("* OK\r\n")
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(capability.format(tag))
+            tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+            mock_tcp.send(imap_reply_login(tag))
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(capability.format(tag))
+            if not cached:
+                tag = mock_tcp.expect(
+                    r'([^ ]*) LIST "" \* RETURN \(STATUS \(MESSAGES UIDNEXT UIDVALIDITY\)\)'
+                ).group(1)
+                mock_tcp.send(
+                    '* LIST (\\HasNoChildren) "/" INBOX\r\n'
+                    "* STATUS INBOX (MESSAGES 0 UIDNEXT 5 UIDVALIDITY 1)\r\n"
+                    '* LIST (\\Noselect \\HasChildren) "/" "[Gmail]"\r\n'
+                    '* LIST (\\HasNoChildren) "/" Archive\r\n'
+                    "* STATUS Archive (MESSAGES 0 UIDNEXT 1 UIDVALIDITY 7)\r\n"
+                    f"{tag} OK List completed\r\n"
+                )
+                # INBOX is unchanged
+                tag = mock_tcp.expect("([^ ]*) EXAMINE Archive").group(1)
+                mock_tcp.send(f"* 0 EXISTS\r\n* OK [UIDVALIDITY 7] UIDs valid\r\n"
+                              f"* OK [UIDNEXT 1] Predicted next UID\r\n{tag} OK [READ-ONLY]\r\n")
+                tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+                mock_tcp.send(imap_close(tag))
+            else:
+                # no LIST, the STATUS commands are pipelined
+                buf = ""
+                while buf.count("\r\n") < 2:
+                    buf += mock_tcp.socket.recv(1024).decode("utf8")
+                statuses = re.findall(r"(\S+) STATUS (\w+) \(MESSAGES UIDNEXT UIDVALIDITY\)\r\n", buf)
+                assert [mailbox for _, mailbox in statuses] == ["INBOX", "Archive"]
+                mock_tcp.send(
+                    "* STATUS INBOX (MESSAGES 0 UIDNEXT 5 UIDVALIDITY 1)\r\n"
+                    f"{statuses[0][0]} OK Status\r\n"
+                    "* STATUS Archive (MESSAGES 0 UIDNEXT 1 UIDVALIDITY 7)\r\n"
+                    f"{statuses[1][0]} OK Status\r\n"
+                )
+            tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+            mock_tcp.send(imap_reply_logout(tag))
+            mock_tcp.close()
+            p.join()
+
+
+def test_imap_idle():
+    mock_tcp = MockTCP()
+    capability = "* CAPABILITY IMAP4rev1 IDLE\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir, "--idle", "INBOX"]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    max_message_size = 10
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+        mock_tcp.send(f"* 0 EXISTS\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n"
+                      f"* OK [UIDNEXT 3] Predicted next UID\r\n{tag} OK [READ-ONLY]\r\n")
+        # stays in INBOX, no CLOSE and EXAMINE again
+        for untagged in ("* OK Still here", "* 1 EXISTS", "* 1 EXPUNGE\r\n* 1 EXISTS"):
+            tag = mock_tcp.expect("([^ ]*) IDLE").group(1)
+            mock_tcp.send("+ idling\r\n")
+            mock_tcp.send(f"{untagged}\r\n")
+            mock_tcp.expect("DONE")
+            mock_tcp.send(f"{tag} OK Idle completed\r\n")
+            if untagged == "* 1 EXISTS":
+                # only the new message is listed
+                tag = mock_tcp.expect(r"([^ ]*) FETCH 1:1 \(UID RFC822.SIZE\)").group(1)
+                mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(3, 30), )))
+            elif "EXPUNGE" in untagged:
+                # message numbers changed, list by UID
+                tag = mock_tcp.expect(r"([^ ]*) UID FETCH 4:\* \(UID RFC822.SIZE\)").group(1)
+                mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(5, 30), )))
+        mock_tcp.expect("([^ ]*) IDLE")
+        p.kill()
+        p.join()
+        mock_tcp.close()
+
+
+def test_imap_idle_untagged_first():
+    mock_tcp = MockTCP()
+    capability = "* CAPABILITY IMAP4rev1 IDLE\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir, "--idle", "INBOX"]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    max_message_size = 10
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    imap_idle_renew = 1
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+        mock_tcp.send(f"* 0 EXISTS\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n"
+                      f"* OK [UIDNEXT 3] Predicted next UID\r\n{tag} OK [READ-ONLY]\r\n")
+        tag = mock_tcp.expect("([^ ]*) IDLE").group(1)
+        # renewed after a second
+        mock_tcp.send("+ idling\r\n")
+        mock_tcp.expect("DONE")
+        mock_tcp.send(f"{tag} OK Idle completed\r\n")
+        # news before the continuation response of the renewed IDLE
+        tag = mock_tcp.expect("([^ ]*) IDLE").group(1)
+        mock_tcp.send("* 1 EXISTS\r\n+ idling\r\n")
+        mock_tcp.expect("DONE")
+        mock_tcp.send(f"{tag} OK Idle completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:1 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(3, 30), )))
+        mock_tcp.expect("([^ ]*) IDLE")
+        p.kill()
+        p.join()
+        mock_tcp.close()
+
+
+def test_imap_idle_uid_cache():
+    mock_tcp = MockTCP()
+    capability = "* CAPABILITY IMAP4rev1 IDLE\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir, "--idle", "INBOX"]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    imap_search = UNSEEN
+                    uid_cache = uids
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+        mock_tcp.send(imap_reply_examine_inbox(tag, exists=0))
+        tag = mock_tcp.expect("([^ ]*) UID SEARCH UNSEEN").group(1)
+        mock_tcp.send(f"* SEARCH\r\n{tag} OK Search completed\r\n")
+        tag = mock_tcp.expect("([^ ]*) IDLE").group(1)
+        mock_tcp.send("+ idling\r\n")
+        mock_tcp.send("* 1 EXISTS\r\n")
+        mock_tcp.expect("DONE")
+        mock_tcp.send(f"{tag} OK Idle completed\r\n")
+        # refreshed without listing anything, which leaves the UID cache alone
+        tag = mock_tcp.expect(r"([^ ]*) UID SEARCH UID 1:\* UNSEEN").group(1)
+        mock_tcp.send(f"* SEARCH\r\n{tag} OK Search completed\r\n")
+        mock_tcp.expect("([^ ]*) IDLE")
+        p.kill()
+        p.join()
+        mock_tcp.close()
+        assert not os.path.exists(f"{tmpdir}/uids")
+
+def test_imap_idle_accounts():
+    mock_tcps = (MockTCP(), MockTCP())
+    capability = "* CAPABILITY IMAP4rev1 IDLE\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir, "--idle", "INBOX",
+                    "-r", "getmailrc-a", "-r", "getmailrc-b"]
+        destination = maildir_init(tmpdir)
+        for (name, mock_tcp) in zip("ab", mock_tcps):
+            with open(f"{tmpdir}/getmailrc-{name}", "w") as f:
+                f.write(
+                    textwrap.dedent(
+                        f"""
+                        [options]
+                        read_all = false
+                        max_message_size = 10
+
+                        [retriever]
+                        type = SimpleIMAPRetriever
+                        server = 127.0.0.1
+                        port = {mock_tcp.server.getsockname()[1]}
+                        username = account_{name}
+                        password = my_mail_password
+
+                        [destination]
+                        type = Maildir
+                        {destination}
+                        """
+                    )
+                )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        tags = []
+        for (name, mock_tcp) in zip("ab", mock_tcps):
+            mock_tcp.accept()
+            mock_tcp.send("* OK\r\n")
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(capability.format(tag))
+            tag = mock_tcp.expect(f'([^ ]*) LOGIN account_{name} "my_mail_password"').group(1)
+            mock_tcp.send(imap_reply_login(tag))
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(capability.format(tag))
+            tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+            mock_tcp.send(f"* 0 EXISTS\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n"
+                          f"* OK [UIDNEXT 3] Predicted next UID\r\n{tag} OK [READ-ONLY]\r\n")
+            tags.append(mock_tcp.expect("([^ ]*) IDLE").group(1))
+            mock_tcp.send("+ idling\r\n")
+        # both accounts IDLE in the same process; only the second one wakes
+        (_, mock_tcp) = mock_tcps
+        mock_tcp.send("* 1 EXISTS\r\n")
+        mock_tcp.expect("DONE")
+        mock_tcp.send(f"{tags[1]} OK Idle completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:1 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(3, 30), )))
+        mock_tcp.expect("([^ ]*) IDLE")
+        p.kill()
+        p.join()
+        for mock_tcp in mock_tcps:
+            mock_tcp.close()
+
+
+def test_imap_idle_accounts_error():
+    mock_tcps = (MockTCP(), MockTCP())
+    capability = "* CAPABILITY IMAP4rev1 IDLE\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir, "--idle", "INBOX",
+                    "-r", "getmailrc-a", "-r", "getmailrc-b"]
+        destination = maildir_init(tmpdir)
+        for (name, mock_tcp) in zip("ab", mock_tcps):
+            with open(f"{tmpdir}/getmailrc-{name}", "w") as f:
+                f.write(
+                    textwrap.dedent(
+                        f"""
+                        [options]
+                        read_all = false
+
+                        [retriever]
+                        type = SimpleIMAPRetriever
+                        server = 127.0.0.1
+                        port = {mock_tcp.server.getsockname()[1]}
+                        username = account_{name}
+                        password = my_mail_password
+                        mailboxes = ("INBOX", "Missing")
+
+                        [destination]
+                        type = Maildir
+                        {destination}
+                        """
+                    )
+                )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        for (name, mock_tcp) in zip("ab", mock_tcps):
+            mock_tcp.accept()
+            mock_tcp.send("* OK\r\n")
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(capability.format(tag))
+            tag = mock_tcp.expect(f'([^ ]*) LOGIN account_{name} "my_mail_password"').group(1)
+            mock_tcp.send(imap_reply_login(tag))
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(capability.format(tag))
+            tag = mock_tcp.expect("([^ ]*) EXAMINE Missing").group(1)
+            if name == "a":
+                mock_tcp.send(f"{tag} NO Mailbox does not exist\r\n")
+            else:
+                mock_tcp.send(imap_reply_examine_inbox(tag, exists=0))
+                tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+                mock_tcp.send(imap_close(tag))
+            tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+            mock_tcp.send(imap_reply_examine_inbox(tag, exists=0))
+            if name == "a":
+                # the error keeps this account from IDLE
+                tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+                mock_tcp.send(imap_close(tag))
+                tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+                mock_tcp.send(imap_reply_logout(tag))
+        # but not the other one
+        mock_tcp.expect("([^ ]*) IDLE")
+        p.kill()
+        p.join()
+        for mock_tcp in mock_tcps:
+            mock_tcp.close()
+
+def test_imap_max_connections():
+    mock_tcp = MockTCP()
+    mock_tcp.server.listen(2)
+    capability = "* CAPABILITY IMAP4rev1\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    mailboxes = ("INBOX", "Other")
+                    max_connections = 2
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        sessions = []
+        for unused in range(2):
+            mock_tcp.accept()
+            sessions.append(mock_tcp.socket)
+            mock_tcp.send("* OK\r\n")
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(capability.format(tag))
+            login = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+            if not sessions[1:]:
+                mock_tcp.send(imap_reply_login(login))
+                tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+                mock_tcp.send(capability.format(tag))
+        # the first session does INBOX while the second one logs in
+        mock_tcp.socket = sessions[0]
+        tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+        mock_tcp.send(imap_reply_examine_inbox(tag, 0))
+        mock_tcp.socket = sessions[1]
+        mock_tcp.send(imap_reply_login(login))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect("([^ ]*) EXAMINE Other").group(1)
+        mock_tcp.send(imap_reply_examine_inbox(tag, 0))
+        mock_tcp.socket = sessions[0]
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        # Other is processed on the second session
+        mock_tcp.socket = sessions[1]
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.socket = sessions[0]
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        p.join()
+        for session in sessions:
+            session.close()
+
+
+def test_imap_gmail_metadata():
+    mock_tcp = MockTCP()
+    capability = "* CAPABILITY IMAP4rev1 X-GM-EXT-1\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+        mock_tcp.send(imap_reply_examine_inbox(tag, exists=1, uidvalidity=1))
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:1 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), )))
+        # labels, thread and message ID come with the body, no second FETCH
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1 \(BODY.PEEK\[] "
+                              r"X-GM-LABELS X-GM-THRID X-GM-MSGID\)").group(1)
+        mock_tcp.send(f'* 1 FETCH (X-GM-THRID 7 X-GM-MSGID 8 X-GM-LABELS '
+                      f'("\\\\Inbox" "a (b)") UID 1 BODY[] {{3}}\r\na\r\n)\r\n'
+                      f'{tag} OK Fetch completed\r\n')
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.close()
+        p.join()
+
+
+def test_imap_move_on_delete():
+    mock_tcp = MockTCP()
+    port = mock_tcp.server.getsockname()[1]
+    capability = "* CAPABILITY IMAP4rev1 MOVE UIDPLUS\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name-INBOX", "w") as f:
+            f.write('1/1\x001745765433\n1/2\x001745765433\n1/3\x001745765433\n')
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    delete = true
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    move_on_delete = Trash
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect("([^ ]*) SELECT INBOX").group(1)
+        mock_tcp.send(f"* 3 EXISTS\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n"
+                      f"{tag} OK [READ-WRITE] Select completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:3 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), FetchSize(2, 3), FetchSize(3, 3))))
+        # one UID MOVE for all, and no EXPUNGE of the whole mailbox
+        tag = mock_tcp.expect(r"([^ ]*) UID MOVE 1:3 Trash").group(1)
+        mock_tcp.send(f"* OK [COPYUID 5 1:3 7:9]\r\n* 1 EXPUNGE\r\n* 1 EXPUNGE\r\n"
+                      f"* 1 EXPUNGE\r\n{tag} OK Move completed\r\n")
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.close()
+        p.join()
+
+
+def test_imap_move_on_delete_fails():
+    mock_tcp = MockTCP()
+    port = mock_tcp.server.getsockname()[1]
+    capability = "* CAPABILITY IMAP4rev1 MOVE UIDPLUS\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    delete = true
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    move_on_delete = Trash
+
+                    [destination]
+                    type = MDA_external
+                    {mda_external_init(tmpdir)}
+                    allow_root_commands = true
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect("([^ ]*) SELECT INBOX").group(1)
+        mock_tcp.send(f"* 2 EXISTS\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n"
+                      f"{tag} OK [READ-WRITE] Select completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:2 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), FetchSize(2, 3))))
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1 \(BODY.PEEK\[]\)").group(1)
+        mock_tcp.send(imap_reply_fetch_body(tag, 1, 1))
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 2 \(BODY.PEEK\[]\)").group(1)
+        mock_tcp.send(imap_reply_fetch_body(tag, 2, 2))
+        tag = mock_tcp.expect(r"([^ ]*) UID MOVE 1:2 Trash").group(1)
+        mock_tcp.send(f"{tag} NO [TRYCREATE] No such mailbox\r\n")
+        mock_tcp.close()
+        p.join()
+        # Still on the server, but not delivered again on the next run
+        with open(f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name-INBOX") as f:
+            assert sorted(line.split("\0")[0] for line in f) == ["1/1", "1/2"]
+
+
+def test_imap_compress():
+    mock_tcp = MockTCP()
+    capability = "* CAPABILITY IMAP4rev1 COMPRESS=DEFLATE\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    imap_compress = true
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect("([^ ]*) COMPRESS DEFLATE").group(1)
+        mock_tcp.send(f"{tag} OK DEFLATE active\r\n")
+        # from here on, both directions are compressed
+        inflater = zlib.decompressobj(-15)
+        deflater = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+
+        def send(buf):
+            mock_tcp.socket.send(deflater.compress(buf.encode("utf8"))
+                                 + deflater.flush(zlib.Z_SYNC_FLUSH))
+
+        def expect(expr):
+            buf = inflater.decompress(mock_tcp.socket.recv(1024)).decode("utf8")
+            m = re.match(expr, buf)
+            assert m, f"{expr} != {buf}"
+            return m
+
+        tag = expect("([^ ]*) EXAMINE INBOX").group(1)
+        send(imap_reply_examine_inbox(tag, exists=1, uidvalidity=1))
+        tag = expect(r"([^ ]*) FETCH 1:1 \(UID RFC822.SIZE\)").group(1)
+        send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), )))
+        tag = expect(r"([^ ]*) UID FETCH 1 \(BODY.PEEK\[]\)").group(1)
+        send(imap_reply_fetch_body(tag, 1, 1))
+        tag = expect("([^ ]*) CLOSE").group(1)
+        send(imap_close(tag))
+        tag = expect("([^ ]*) LOGOUT").group(1)
+        send(imap_reply_logout(tag))
+        mock_tcp.close()
+        p.join()
+
+
+def test_imap_search_policies():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        port = mock_tcp.server.getsockname()[1]
+        with open(f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name-INBOX", "w") as f:
+            f.write('1/1\x001745765433\n')
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    delete_after = 1
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    imap_search_policies = true
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect("([^ ]*) SELECT INBOX").group(1)
+        mock_tcp.send(textwrap.dedent(
+            f"""\
+            * 2 EXISTS\r
+            * OK [UIDVALIDITY 1] UIDs valid\r
+            {tag} OK [READ-WRITE] Select completed\r
+            """
+        ))
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:2 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), FetchSize(2, 3))))
+        # old and retrieved before: deleted without getmail looking at it
+        tag = mock_tcp.expect(r"([^ ]*) UID SEARCH BEFORE \d+-[A-Z][a-z]{2}-\d{4}").group(1)
+        mock_tcp.send(f"* SEARCH 1\r\n{tag} OK Search completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 2 \(BODY.PEEK\[]\)").group(1)
+        mock_tcp.send(imap_reply_fetch_body(tag, 2, 2))
+        tag = mock_tcp.expect(r"([^ ]*) UID STORE 1 FLAGS \(\\Deleted \\Seen\)").group(1)
+        mock_tcp.send(f"{tag} OK completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) EXPUNGE").group(1)
+        mock_tcp.send(f"{tag} OK completed\r\n")
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.close()
+        p.join()
+
+
+def test_imap_search_policies_only_oldmail_file():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        port = mock_tcp.server.getsockname()[1]
+        with open(f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name-INBOX", "w") as f:
+            f.write('1/1\x001745765433\n')
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    delete_after = 1
+                    only_oldmail_file = true
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    imap_search_policies = true
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect("([^ ]*) SELECT INBOX").group(1)
+        mock_tcp.send(textwrap.dedent(
+            f"""\
+            * 2 EXISTS\r
+            * OK [UIDVALIDITY 1] UIDs valid\r
+            {tag} OK [READ-WRITE] Select completed\r
+            """
+        ))
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:2 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), FetchSize(2, 3))))
+        # nothing searched for, nor deleted
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.close()
+        p.join()
+
+
+def test_imap_search_policies_qresync():
+    mock_tcp = MockTCP()
+    port = mock_tcp.server.getsockname()[1]
+    capability = "* CAPABILITY IMAP4rev1 ENABLE CONDSTORE QRESYNC\r\n{} OK hello\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name-INBOX", "w") as f:
+            f.write('1/1\x001745765433\n1/2\x001745765433\n')
+        with open(f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name.state", "w") as f:
+            f.write("INBOX\x00highestmodseq=100\x00pending=\x00uidvalidity=1\n")
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    delete_after = 1
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    imap_qresync = true
+                    imap_search_policies = true
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect("([^ ]*) ENABLE QRESYNC").group(1)
+        mock_tcp.send(f"* ENABLED QRESYNC\r\n{tag} OK Enabled\r\n")
+        # the server finds what to delete, so the messages retrieved before
+        # are not listed again
+        tag = mock_tcp.expect(r"([^ ]*) SELECT INBOX \(QRESYNC \(1 100\)\)").group(1)
+        mock_tcp.send(f"* 3 EXISTS\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n"
+                      f"* OK [HIGHESTMODSEQ 120] Highest\r\n"
+                      f"{tag} OK [READ-WRITE] Select completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1:\* \(UID RFC822.SIZE\) \(CHANGEDSINCE 100\)").group(1)
+        mock_tcp.send(f"* 3 FETCH (UID 3 RFC822.SIZE 3 MODSEQ (110))\r\n{tag} OK Fetch completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) UID SEARCH BEFORE \d+-[A-Z][a-z]{2}-\d{4}").group(1)
+        mock_tcp.send(f"* SEARCH 1 2\r\n{tag} OK Search completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 3 \(BODY.PEEK\[]\)").group(1)
+        mock_tcp.send(imap_reply_fetch_body(tag, 3, 3))
+        tag = mock_tcp.expect(r"([^ ]*) UID STORE 1:2 FLAGS \(\\Deleted \\Seen\)").group(1)
+        mock_tcp.send(f"{tag} OK completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) EXPUNGE").group(1)
+        mock_tcp.send(f"{tag} OK completed\r\n")
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.close()
+        p.join()
+
+def test_imap_search_policies_pool():
+    mock_tcp = MockTCP()
+    mock_tcp.server.listen(2)
+    port = mock_tcp.server.getsockname()[1]
+    capability = "* CAPABILITY IMAP4rev1\r\n{} OK hello\r\n"
+    selected = "* {} EXISTS\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n{} OK [READ-WRITE]\r\n"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/oldmail-127.0.0.1-{port}-account_name-Other", "w") as f:
+            f.write('1/1\x001745765433\n')
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    read_all = false
+                    delete_after = 1
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {port}
+                    username = account_name
+                    password = my_mail_password
+                    mailboxes = ("INBOX", "Other")
+                    max_connections = 2
+                    imap_search_policies = true
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        sessions = []
+        for unused in range(2):
+            mock_tcp.accept()
+            sessions.append(mock_tcp.socket)
+            mock_tcp.send("* OK\r\n")
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(capability.format(tag))
+            login = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+            if not sessions[1:]:
+                mock_tcp.send(imap_reply_login(login))
+                tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+                mock_tcp.send(capability.format(tag))
+        mock_tcp.socket = sessions[0]
+        tag = mock_tcp.expect("([^ ]*) SELECT INBOX").group(1)
+        mock_tcp.send(selected.format(0, tag))
+        # the second session selects Other and searches it, once
+        mock_tcp.socket = sessions[1]
+        mock_tcp.send(imap_reply_login(login))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(capability.format(tag))
+        tag = mock_tcp.expect("([^ ]*) SELECT Other").group(1)
+        mock_tcp.send(selected.format(1, tag))
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:1 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3),)))
+        tag = mock_tcp.expect(r"([^ ]*) UID SEARCH BEFORE \d+-[A-Z][a-z]{2}-\d{4}").group(1)
+        mock_tcp.send(f"* SEARCH 1\r\n{tag} OK Search completed\r\n")
+        mock_tcp.socket = sessions[0]
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        mock_tcp.socket = sessions[1]
+        tag = mock_tcp.expect(r"([^ ]*) UID STORE 1 FLAGS \(\\Deleted \\Seen\)").group(1)
+        mock_tcp.send(f"{tag} OK completed\r\n")
+        tag = mock_tcp.expect(r"([^ ]*) EXPUNGE").group(1)
+        mock_tcp.send(f"{tag} OK completed\r\n")
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.socket = sessions[0]
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        p.join()
+        for session in sessions:
+            session.close()
+
+
+def test_imap_jobs():
+    servers = (MockTCP(), MockTCP())
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir, "--jobs", "2"]
+        destination = maildir_init(tmpdir)
+        for (n, mock_tcp) in enumerate(servers):
+            mock_tcp.server.settimeout(10)
+            sys.argv += ["-r", f"getmailrc{n}"]
+            with open(f"{tmpdir}/getmailrc{n}", "w") as f:
+                f.write(
+                    textwrap.dedent(
+                        f"""
+                        [retriever]
+                        type = SimpleIMAPRetriever
+                        server = 127.0.0.1
+                        port = {mock_tcp.server.getsockname()[1]}
+                        username = account_name
+                        password = my_mail_password
+
+                        [destination]
+                        type = Maildir
+                        {destination}
+                        """
+                    )
+                )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        # Both accounts are connected at once
+        for mock_tcp in servers:
+            mock_tcp.accept()
+            mock_tcp.send("* OK\r\n")
+        for mock_tcp in servers:
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(imap_reply_capability(tag))
+            tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+            mock_tcp.send(imap_reply_login(tag))
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(imap_reply_capability(tag))
+            tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+            mock_tcp.send(imap_reply_examine_inbox(tag, exists=1, uidvalidity=1))
+            tag = mock_tcp.expect(r"([^ ]*) FETCH 1:1 \(UID RFC822.SIZE\)").group(1)
+            mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), )))
+            tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1 \(BODY.PEEK\[]\)").group(1)
+            mock_tcp.send(imap_reply_fetch_body(tag, 1, 1))
+            tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+            mock_tcp.send(imap_close(tag))
+            tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+            mock_tcp.send(imap_reply_logout(tag))
+            mock_tcp.close()
+        p.join()
+
+
+def test_imap_capability_cache():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    imap_capability_cache_ttl = 3600
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        plain = "AGFjY291bnRfbmFtZQBteV9tYWlsX3Bhc3N3b3Jk"
+        for cached in (False, True):
+            p = multiprocessing.Process(target=get_getmail, args=())
+            p.start()
+            mock_tcp.accept()
+            mock_tcp.send("* OK\r\n")
+            tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+            mock_tcp.send(f"* CAPABILITY IMAP4 SASL-IR\r\n{tag} OK hello\r\n")
+            if not cached:
+                tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+                mock_tcp.send(f"{tag} NO Use AUTHENTICATE\r\n")
+            # Straight to AUTHENTICATE, with the initial response (SASL-IR)
+            tag = mock_tcp.expect(f"([^ ]*) AUTHENTICATE PLAIN {plain}").group(1)
+            if cached:
+                mock_tcp.send(f"{tag} OK Logged in\r\n")
+            else:
+                # capabilities sent along, no CAPABILITY command
+                mock_tcp.send(f"{tag} OK [CAPABILITY IMAP4 IDLE] Logged in\r\n")
+            tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+            mock_tcp.send(imap_reply_examine_inbox(tag, exists=1, uidvalidity=1))
+            tag = mock_tcp.expect(r"([^ ]*) FETCH 1:1 \(UID RFC822.SIZE\)").group(1)
+            mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), )))
+            tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1 \(BODY.PEEK\[]\)").group(1)
+            mock_tcp.send(imap_reply_fetch_body(tag, 1, 1))
+            tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+            mock_tcp.send(imap_close(tag))
+            tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+            mock_tcp.send(imap_reply_logout(tag))
+            mock_tcp.close()
+            p.join()
+
+
+def test_imap_fetch_batch():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    imap_fetch_batch = 2
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+        mock_tcp.send(imap_reply_examine_inbox(tag, exists=3, uidvalidity=1))
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:3 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), FetchSize(2, 3), FetchSize(3, 3))))
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1:2 \(UID BODY.PEEK\[]\)").group(1)
+        mock_tcp.send(imap_reply_fetch_bodies(tag, (2, 1)))
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 3 \(BODY.PEEK\[]\)").group(1)
+        mock_tcp.send(imap_reply_fetch_body(tag, 3, 3))
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.close()
+        p.join()
+
+
+def test_imap_fetch_batch_max_bytes():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [options]
+                    max_bytes_per_session = 7
+
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    imap_fetch_batch = 3
+
+                    [destination]
+                    type = MDA_external
+                    {mda_external_init(tmpdir)}
+                    allow_root_commands = true
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+        mock_tcp.send(imap_reply_examine_inbox(tag, exists=3, uidvalidity=1))
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:3 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), FetchSize(2, 3), FetchSize(3, 3))))
+        # the third message would surpass max_bytes_per_session
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1:2 \(UID BODY.PEEK\[]\)").group(1)
+        mock_tcp.send(imap_reply_fetch_bodies(tag, (1, 2)))
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.close()
+        p.join()
+
+def test_imap_fetch_batch_fails():
+    mock_tcp = MockTCP()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sys.argv = ["getmail", "--getmaildir", tmpdir]
+        with open(f"{tmpdir}/getmailrc", "w") as f:
+            f.write(
+                textwrap.dedent(
+                    f"""
+                    [retriever]
+                    type = SimpleIMAPRetriever
+                    server = 127.0.0.1
+                    port = {mock_tcp.server.getsockname()[1]}
+                    username = account_name
+                    password = my_mail_password
+                    imap_fetch_batch = 2
+
+                    [destination]
+                    type = Maildir
+                    {maildir_init(tmpdir)}
+                    """
+                )
+            )
+        p = multiprocessing.Process(target=get_getmail, args=())
+        p.start()
+        mock_tcp.accept()
+        mock_tcp.send("* OK\r\n")
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect('([^ ]*) LOGIN account_name "my_mail_password"').group(1)
+        mock_tcp.send(imap_reply_login(tag))
+        tag = mock_tcp.expect("([^ ]*) CAPABILITY").group(1)
+        mock_tcp.send(imap_reply_capability(tag))
+        tag = mock_tcp.expect("([^ ]*) EXAMINE INBOX").group(1)
+        mock_tcp.send(imap_reply_examine_inbox(tag, exists=4, uidvalidity=1))
+        tag = mock_tcp.expect(r"([^ ]*) FETCH 1:4 \(UID RFC822.SIZE\)").group(1)
+        mock_tcp.send(imap_reply_fetch_s(tag, 1, (FetchSize(1, 3), FetchSize(2, 3),
+                                                  FetchSize(3, 3), FetchSize(4, 3))))
+        tag = mock_tcp.expect(r"([^ ]*) UID FETCH 1:2 \(UID BODY.PEEK\[]\)").group(1)
+        mock_tcp.send(f"{tag} NO Too many messages\r\n")
+        # one message at a time from here on, no second batch for 3:4
+        for uid in (1, 2, 3, 4):
+            tag = mock_tcp.expect(rf"([^ ]*) UID FETCH {uid} \(BODY.PEEK\[]\)").group(1)
+            mock_tcp.send(imap_reply_fetch_body(tag, uid, uid))
+        tag = mock_tcp.expect("([^ ]*) CLOSE").group(1)
+        mock_tcp.send(imap_close(tag))
+        tag = mock_tcp.expect("([^ ]*) LOGOUT").group(1)
+        mock_tcp.send(imap_reply_logout(tag))
+        mock_tcp.close()
+        p.join()